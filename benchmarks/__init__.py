@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the library's hot paths.
+
+Run ``python -m benchmarks --help`` from the repository root.
+"""
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from .run import main
+
+
+sys.exit(main())
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Runs benchmarks and compares them against a saved baseline.
+
+Each benchmark runs a public function over a synthetic log of every requested
+size and reports throughput in rows per second and peak memory allocated while
+running it. Saved results can be compared in later runs, and benchmarks whose
+throughput dropped by more than the threshold are reported as regressions.
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+from datetime import timedelta
+from functools import partial
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+from loganalysis import logre, utils
+from loganalysis.funnel import Funnel
+from loganalysis.paths import TopPaths
+
+from .workload import generate
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+#: Length of a second in timestamps of each ts_type of the workload
+UNITS = {
+    'datetime': timedelta(seconds=1),
+    'epoch': 1.0,
+}
+
+# Durations in seconds
+TIMEOUT = 30 * 60
+WINDOW = 60
+DEDUP_HORIZON = 60
+
+LOG_PATTERN = (
+    r'[[ {{2:login}} ]][[ ]]*?[[ {{2:acquired}} {{3:(legend|unique)}} ]]'
+)
+TUPLE_PATTERN = r'{{2:acquired}} {{3:(legend|unique)}}'
+FSM_TABLE = {
+    ('init', 'login'): (None, 'logged-in'),
+    ('logged-in', 'buy'): ('buy', 'logged-in'),
+    ('logged-in', 'logout'): ('logout', 'init'),
+    ('logged-in', None): ('timeout', 'init'),
+}
+
+
+def _sessions(log, unit):
+    return [
+        session
+        for _, session in utils.sessionize(log, 0, 1, TIMEOUT * unit)
+    ]
+
+
+def _consume(iterable):
+    for _ in iterable:
+        pass
+
+
+# Each benchmark takes a log or a list of sessions, and `unit`, a second in
+# timestamps of the log.
+
+def bench_sessionize(log, unit):
+    _consume(utils.sessionize(iter(log), 0, 1, TIMEOUT * unit))
+
+
+def bench_encode(sessions, unit):
+    encode = logre.encode
+    for session in sessions:
+        encode(session)
+
+
+def bench_tuple_regex(log, unit):
+    _consume(logre.TupleRegex(TUPLE_PATTERN).finditer(log))
+
+
+def bench_log_regex(sessions, unit):
+    _consume(logre.LogRegex(LOG_PATTERN).finditer_m(sessions))
+
+
+def bench_streaming_log_regex(log, unit):
+    _consume(logre.StreamingLogRegex(LOG_PATTERN, 0, 1, TIMEOUT * unit)
+             .finditer(log))
+
+
+def bench_fsm(sessions, unit):
+    for session in sessions:
+        _consume(utils.fsm((row[2] for row in session), 'init', FSM_TABLE))
+
+
+def bench_window(log, unit):
+    _consume(utils.window(iter(log), 0, WINDOW * unit, key_index=2,
+                          cid_index=1))
+
+
+def bench_sample(log, unit):
+    _consume(utils.sample(log, 1, 0.1))
+
+
+def bench_dedup(log, unit):
+    _consume(utils.Deduplicator(0, DEDUP_HORIZON * unit).filter(log))
+
+
+def bench_funnel(sessions, unit):
+    Funnel([r'{{2:login}}', r'{{2:shop}}', r'{{2:buy}}']).count(sessions)
+
+
+def bench_top_paths(sessions, unit):
+    TopPaths(3, 2, capacity=100).update_m(sessions)
+
+
+#: name -> (function, whether the function takes sessions instead of a log)
+BENCHMARKS = {
+    'sessionize': (bench_sessionize, False),
+    'encode': (bench_encode, True),
+    'TupleRegex.finditer': (bench_tuple_regex, False),
+    'LogRegex.finditer_m': (bench_log_regex, True),
+    'StreamingLogRegex.finditer': (bench_streaming_log_regex, False),
+    'fsm': (bench_fsm, True),
+    'window': (bench_window, False),
+    'sample': (bench_sample, False),
+    'Deduplicator.filter': (bench_dedup, False),
+    'Funnel.count': (bench_funnel, True),
+    'TopPaths.update_m': (bench_top_paths, True),
+}
+
+
+def measure(func, arg, n_rows, repeat=3):
+    """Returns a dict of the best rows/sec of `repeat` runs and the peak
+    memory in bytes allocated during a separate traced run."""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = _timer()
+        func(arg)
+        elapsed = _timer() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(arg)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'rows_per_sec': n_rows / best if best else float('inf'),
+        'peak_bytes': peak,
+    }
+
+
+def run(names, sizes, seed=0, repeat=3, ts_type='datetime', **workload):
+    """Runs benchmarks and returns a dict of ``'name/size'`` -> result.
+    Durations such as the session timeout are given in the unit of
+    timestamps of `ts_type`."""
+    unit = UNITS[ts_type]
+    results = {}
+    for size in sizes:
+        log = generate(n_clients=size, seed=seed, ts_type=ts_type,
+                       **workload)
+        sessions = _sessions(log, unit)
+        for name in names:
+            func, takes_sessions = BENCHMARKS[name]
+            arg = sessions if takes_sessions else log
+            results['%s/%d' % (name, size)] = measure(
+                partial(func, unit=unit), arg, len(log), repeat
+            )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns a list of (key, baseline rows/sec, current rows/sec) of
+    benchmarks slower than the baseline by more than `threshold`."""
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        before = baseline[key]['rows_per_sec']
+        after = result['rows_per_sec']
+        if after < before * (1 - threshold):
+            regressions.append((key, before, after))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help='benchmarks to run (default: all of %s)'
+                             % ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='comma-separated numbers of clients '
+                             '(default: %(default)s)')
+    parser.add_argument('--session-length', type=int, default=10,
+                        help='mean number of rows in a session')
+    parser.add_argument('--distribution', default='geometric',
+                        choices=['geometric', 'pareto', 'fixed'])
+    parser.add_argument('--columns', type=int, default=4)
+    parser.add_argument('--ts-type', default='datetime',
+                        choices=sorted(UNITS),
+                        help='type of timestamps (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', metavar='PATH',
+                        help='save results as a baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare results against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown ratio reported as a regression '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    names = args.names or sorted(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(unknown))
+
+    # Results are only comparable between runs over the same workload
+    workload = {
+        'seed': args.seed,
+        'mean_session_length': args.session_length,
+        'distribution': args.distribution,
+        'n_columns': args.columns,
+        'ts_type': args.ts_type,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        if saved.get('workload') != workload:
+            parser.error('%s was run over a different workload: %s'
+                         % (args.compare, saved.get('workload')))
+        baseline = saved['results']
+
+    results = run(
+        names, [int(size) for size in args.sizes.split(',')],
+        repeat=args.repeat, **workload
+    )
+
+    for key, result in sorted(results.items()):
+        peak = result['peak_bytes']
+        print('%-32s %14.0f rows/s %10s' % (
+            key, result['rows_per_sec'],
+            '-' if peak is None else '%.1f MiB' % (peak / 1048576.0),
+        ))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'workload': workload, 'results': results}, f,
+                      indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after in regressions:
+            print('REGRESSION %s: %.0f -> %.0f rows/s (%.0f%%)' % (
+                key, before, after, 100.0 * (after - before) / before
+            ))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
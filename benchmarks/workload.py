@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Seeded synthetic log generator"""
+
+import math
+import random
+from datetime import datetime, timedelta
+
+
+EVENTS = [
+    'login', 'logout', 'stage/1', 'stage/2', 'stage/3', 'shop', 'buy',
+    'acquired', 'fail', 'success',
+]
+ITEMS = ['common', 'rare', 'legend', 'unique']
+
+
+def generate(n_clients=1000, mean_session_length=10, distribution='geometric',
+             n_columns=4, ts_type='datetime', seed=0, sessions_per_client=1,
+             session_gap=timedelta(hours=1), event_gap=timedelta(seconds=30)):
+    """
+    Returns a list of rows ordered by timestamp.
+
+    Each row is (timestamp, client id, event, extra columns...). Every client
+    has `sessions_per_client` sessions separated by `session_gap`, and rows in
+    a session are on average `event_gap` apart, so sessionizing with a timeout
+    between the two gaps recovers the generated sessions. The same arguments
+    always produce the same log.
+
+    :param n_clients: number of clients
+    :type  n_clients: int
+    :param mean_session_length: mean number of rows in a session
+    :type  mean_session_length: int
+    :param distribution: distribution of session lengths. One of
+                         ``'geometric'``, ``'pareto'`` or ``'fixed'``.
+    :type  distribution: str
+    :param n_columns: number of columns in a row, at least 3
+    :type  n_columns: int
+    :param ts_type: ``'datetime'`` for :class:`~datetime.datetime`
+                    timestamps or ``'epoch'`` for Unix time in float seconds
+    :type  ts_type: str
+    :param seed: random seed
+    :type  seed: int
+    """
+    if n_columns < 3:
+        raise ValueError('n_columns should be at least 3')
+    rnd = random.Random(seed)
+    draw_length = _length_distribution(rnd, distribution, mean_session_length)
+    origin = datetime(2015, 1, 1)
+    span = session_gap.total_seconds() * 2
+    mean_gap = event_gap.total_seconds()
+
+    log = []
+    for i in range(n_clients):
+        cid = 'user/%d' % i
+        start = rnd.uniform(0, span)
+        for _ in range(sessions_per_client):
+            ts = start
+            for _ in range(draw_length()):
+                row = [ts, cid, rnd.choice(EVENTS)]
+                row.extend(
+                    rnd.choice(ITEMS) for _ in range(n_columns - 3)
+                )
+                log.append(row)
+                ts += rnd.uniform(0, 2 * mean_gap)
+            start = ts + session_gap.total_seconds()
+
+    log.sort(key=lambda row: row[0])
+    for row in log:
+        if ts_type == 'datetime':
+            row[0] = origin + timedelta(seconds=row[0])
+        elif ts_type == 'epoch':
+            row[0] = _timestamp(origin) + row[0]
+        else:
+            raise ValueError('Unknown ts_type: %s' % ts_type)
+    return [tuple(row) for row in log]
+
+
+def _length_distribution(rnd, distribution, mean):
+    if distribution == 'fixed':
+        return lambda: mean
+    if distribution == 'geometric':
+        if mean <= 1:
+            return lambda: 1
+        rate = -math.log(1 - 1.0 / mean)
+        return lambda: 1 + int(rnd.expovariate(rate))
+    if distribution == 'pareto':
+        # Shape 2 gives a mean of twice the scale
+        return lambda: max(1, int(rnd.paretovariate(2) * mean / 2))
+    raise ValueError('Unknown distribution: %s' % distribution)
+
+
+def _timestamp(dt):
+    return (dt - datetime(1970, 1, 1)).total_seconds()
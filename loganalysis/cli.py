@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+``loganalysis`` command-line pipeline.
+
+Chains the library's stages over files or the standard input::
+
+    read -> sample -> dedup -> filter -> sessionize -> match/fsm -> output
+
+For example, to find sessions acquiring a legend item in a tab-separated log
+whose first column is a timestamp and second column is a user id::
+
+    loganalysis --timeout 600 \\
+        --match '[[ {{2:login}} ]][[ ]]*?[[ {{2:acquired}} {{3:legend}} ]]' \\
+        app.log
+
+Input is streamed line by line. Matching runs in `--workers` processes, each
+taking `--batch-size` sessions at a time, while reading and sessionization
+stay in the main process. At most twice as many batches as workers are in
+flight, so memory doesn't grow with the input.
+"""
+
+import argparse
+import codecs
+import io
+import json
+import sys
+from collections import deque
+from datetime import datetime, timedelta
+from functools import partial
+from multiprocessing import Pool
+
+from . import __version__
+from .logre import LogRegex, TupleRegex, encode_tuple, _DEFAULT_TIME_FORMAT
+from .metrics import Metrics, PrometheusFileSink
+from .utils import Deduplicator, fsm, sample, sessionize
+
+
+def main(argv=None):
+    """Entry point of the ``loganalysis`` console script"""
+    args = _parser().parse_args(argv)
+    # Output is encoded here rather than by sys.stdout, whose encoding
+    # depends on the terminal and is ASCII on Python 2 when piped
+    out = codecs.getwriter(args.encoding)(
+        getattr(sys.stdout, 'buffer', sys.stdout)
+    )
+    run(args, _read_lines(args.inputs, args.encoding), out.write)
+    out.flush()
+    return 0
+
+
+def run(args, lines, write):
+    """Runs the pipeline described by parsed `args` over `lines`, passing
+    each formatted output line to `write`."""
+    metrics = None
+    if args.metrics_file is not None:
+        metrics = Metrics([PrometheusFileSink(args.metrics_file)],
+                          args.metrics_interval)
+
+    rows = _parse_rows(lines, args)
+    if args.sample_rate is not None:
+        rows = sample(rows, args.cid_index, args.sample_rate, args.sample_salt)
+    if args.dedup_horizon is not None:
+        dedup = Deduplicator(args.ts_index,
+                             timedelta(seconds=args.dedup_horizon))
+        rows = dedup.filter(rows)
+    if args.filter is not None:
+        rows = TupleRegex(args.filter, args.sep).finditer(rows)
+
+    sessions = sessionize(rows, args.ts_index, args.cid_index,
+                          timedelta(seconds=args.timeout), metrics=metrics)
+
+    if args.match is not None:
+        stage = _Match(args.match, args.sep)
+    elif args.fsm is not None:
+        with io.open(args.fsm, encoding='utf-8') as f:
+            table = _load_fsm_table(json.load(f))
+        stage = _StateMachine(table, args.init_state, args.event_index)
+    else:
+        stage = _Sessions()
+
+    if args.format == 'json':
+        formatter = partial(_format_json, stage.kind)
+    else:
+        formatter = partial(_format_tsv, stage.kind, args.sep)
+
+    batches = _batches(sessions, args.batch_size)
+    n_records = 0
+    for records in _map(stage, batches, args.workers):
+        for record in records:
+            write(formatter(n_records, record) + u'\n')
+            n_records += 1
+
+    if metrics is not None:
+        metrics.flush()
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='loganalysis',
+        description='Sessionizes a log and finds patterns in each session.',
+    )
+    parser.add_argument('inputs', nargs='*', default=['-'], metavar='FILE',
+                        help='input files. "-" or nothing reads stdin.')
+    parser.add_argument('--version', action='version', version=__version__)
+
+    group = parser.add_argument_group('read')
+    group.add_argument('--sep', default='\t',
+                       help='column separator (default: tab)')
+    group.add_argument('--encoding', default='utf-8',
+                       help='encoding of input and output '
+                            '(default: %(default)s)')
+    group.add_argument('--ts-index', type=int, default=0,
+                       help='index of timestamp column (default: 0)')
+    group.add_argument('--ts-format', default=_DEFAULT_TIME_FORMAT,
+                       help='strptime() format of timestamps, or "epoch" '
+                            'for Unix time in seconds '
+                            '(default: %(default)s)')
+    group.add_argument('--cid-index', type=int, default=1,
+                       help='index of client id column (default: 1)')
+
+    group = parser.add_argument_group('filter')
+    group.add_argument('--sample-rate', type=float,
+                       help='fraction of clients to keep')
+    group.add_argument('--sample-salt', default='',
+                       help='salt of client sampling hash')
+    group.add_argument('--dedup-horizon', type=float, metavar='SECONDS',
+                       help='drop duplicate rows seen within the horizon')
+    group.add_argument('--filter', metavar='PATTERN',
+                       help='keep rows matching a TupleRegex pattern')
+
+    group = parser.add_argument_group('sessionize')
+    group.add_argument('--timeout', type=float, default=1800,
+                       metavar='SECONDS',
+                       help='session timeout (default: 1800)')
+
+    group = parser.add_argument_group('match')
+    stages = group.add_mutually_exclusive_group()
+    stages.add_argument('--match', metavar='PATTERN',
+                        help='output LogRegex matches in each session')
+    stages.add_argument('--fsm', metavar='TABLE',
+                        help='output actions of a state machine run over '
+                             'each session. TABLE is a JSON file holding a '
+                             'list of [state, event, action, next state].')
+    group.add_argument('--init-state', default='init',
+                       help='initial state of --fsm (default: init)')
+    group.add_argument('--event-index', type=int, default=2,
+                       help='index of event column for --fsm (default: 2)')
+
+    group = parser.add_argument_group('output')
+    group.add_argument('--format', choices=['tsv', 'json'], default='tsv')
+    group.add_argument('--workers', type=int, default=1,
+                       help='number of matching processes (default: 1)')
+    group.add_argument('--batch-size', type=int, default=1000,
+                       help='sessions per task sent to a worker '
+                            '(default: 1000)')
+    group.add_argument('--metrics-file', metavar='PATH',
+                       help='write sessionize metrics to a file in '
+                            'Prometheus text format')
+    group.add_argument('--metrics-interval', type=float, default=10,
+                       metavar='SECONDS',
+                       help='interval between metrics file updates '
+                            '(default: 10)')
+    return parser
+
+
+def _read_lines(inputs, encoding):
+    for path in inputs:
+        if path == '-':
+            if hasattr(sys.stdin, 'buffer'):
+                f = io.TextIOWrapper(sys.stdin.buffer, encoding=encoding)
+            else:
+                # sys.stdin of Python 2 is a file object TextIOWrapper
+                # can't wrap
+                f = io.open(sys.stdin.fileno(), encoding=encoding,
+                            closefd=False)
+        else:
+            f = io.open(path, encoding=encoding)
+        with f:
+            for line in f:
+                yield line
+
+
+def _parse_rows(lines, args):
+    sep = args.sep
+    ts_index = args.ts_index
+    ts_format = args.ts_format
+
+    def parse_ts(ts):
+        if ts_format == 'epoch':
+            return datetime.utcfromtimestamp(float(ts))
+        return datetime.strptime(ts, ts_format)
+
+    for line in lines:
+        line = line.rstrip(u'\r\n')
+        if not line:
+            continue
+        row = line.split(sep)
+        row[ts_index] = parse_ts(row[ts_index])
+        yield tuple(row)
+
+
+def _load_fsm_table(entries):
+    return dict(
+        ((state, event), (action, next_state))
+        for state, event, action, next_state in entries
+    )
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _map(stage, batches, workers):
+    """Applies `stage` to each batch in order, using up to `workers`
+    processes."""
+    if workers <= 1:
+        for batch in batches:
+            yield stage(batch)
+        return
+
+    pool = Pool(workers, _init_worker, (stage,))
+    try:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(_run_worker, (batch,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+_worker_stage = None
+
+
+def _init_worker(stage):
+    global _worker_stage
+    _worker_stage = stage
+
+
+def _run_worker(batch):
+    return _worker_stage(batch)
+
+
+class _Sessions(object):
+    kind = 'session'
+
+    def __call__(self, batch):
+        return batch
+
+
+class _Match(object):
+    kind = 'match'
+
+    def __init__(self, pattern, col_sep):
+        self._regex = LogRegex(pattern, col_sep)
+
+    def __call__(self, batch):
+        return [
+            (cid, match)
+            for cid, session in batch
+            for match in self._regex.finditer(session)
+        ]
+
+
+class _StateMachine(object):
+    kind = 'action'
+
+    def __init__(self, table, init_state, event_index):
+        self._table = table
+        self._init_state = init_state
+        self._event_index = event_index
+
+    def __call__(self, batch):
+        event_index = self._event_index
+        return [
+            (cid, action)
+            for cid, session in batch
+            for action in fsm(
+                (row[event_index] for row in session),
+                self._init_state, self._table
+            )
+        ]
+
+
+def _format_tsv(kind, sep, n, record):
+    # Rows of a session or a match are prefixed with client id and record
+    # number, so that consecutive records of the same client can be told
+    # apart.
+    cid, value = record
+    if kind == 'action':
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        return sep.join([cid, str(n)] + [u'%s' % v for v in value])
+    return u'\n'.join(
+        sep.join([cid, str(n), encode_tuple(row, sep)]) for row in value
+    )
+
+
+def _format_json(kind, n, record):
+    cid, value = record
+    if kind != 'action':
+        value = [
+            [_json_value(token) for token in row] for row in value
+        ]
+    return json.dumps({'cid': cid, 'n': n, kind: value}, ensure_ascii=False)
+
+
+def _json_value(token):
+    if isinstance(token, datetime):
+        return token.strftime(_DEFAULT_TIME_FORMAT)
+    return token
+
+
+if __name__ == '__main__':
+    sys.exit(main())
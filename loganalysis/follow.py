@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental reading of growing log files.
+
+:class:`Tail` remembers how far each file has been read, so a periodic job
+only pays for the lines appended since its previous run. Together with the
+`sessions` argument of :func:`~loganalysis.utils.sessionize`, sessions that
+span several runs are resumed instead of being cut at the end of each run.
+"""
+
+import os
+import pickle
+import time
+
+
+class Tail(object):
+    """
+    Reads lines appended to one or more files since the last saved offsets.
+
+    A typical incremental job looks like this::
+
+        tail = Tail(['app.log'], 'app.log.state')
+        sessions = tail.state.setdefault('sessions', OrderedDict())
+        rows = (parse(line) for line in tail.lines())
+        for cid, session in sessionize(rows, 0, 1, timeout, sessions):
+            ...
+        tail.save()
+
+    :meth:`save` writes byte offsets and :attr:`state` atomically, so the
+    offsets always agree with the pipeline state saved with them. Nothing is
+    written until it is called.
+
+    Only complete lines are read; a trailing line without a newline is left
+    for the next read. A file whose inode changes is considered rotated: the
+    old file is read to its end if it is still open, and the new file is read
+    from the beginning. A file that becomes shorter than its offset is
+    considered truncated and is read from the beginning.
+
+    Lines of multiple files are not merged by timestamp. Each poll reads the
+    files one after another.
+
+    :param paths: paths of files to read
+    :type  paths: list
+    :param state_path: path of file to persist offsets and state in. If
+                       `None`, nothing is persisted.
+    :type  state_path: str
+    :param encoding: encoding of files
+    :type  encoding: str
+    """
+    def __init__(self, paths, state_path=None, encoding='utf-8',
+                 chunk_size=65536):
+        self._paths = list(paths)
+        self._state_path = state_path
+        self._encoding = encoding
+        self._chunk_size = chunk_size
+        self._files = {}
+
+        #: path -> (inode, byte offset of the first unread line)
+        self.offsets = {}
+
+        #: arbitrary picklable objects saved together with the offsets
+        self.state = {}
+
+        if state_path is not None and os.path.exists(state_path):
+            with open(state_path, 'rb') as f:
+                saved = pickle.load(f)
+            self.offsets = saved['offsets']
+            self.state = saved['state']
+
+    def lines(self, follow=False, interval=1.0):
+        """
+        Yields new lines without trailing newlines.
+
+        :param follow: if `True`, keep polling files for new lines forever
+                       instead of stopping at the end of the files
+        :type  follow: bool
+        :param interval: seconds to wait when no file has new lines
+        :type  interval: float
+        """
+        while True:
+            n_lines = 0
+            for path in self._paths:
+                for line in self._read(path):
+                    n_lines += 1
+                    yield line
+            if not follow:
+                return
+            if n_lines == 0:
+                time.sleep(interval)
+
+    def save(self):
+        """Persists offsets and :attr:`state`."""
+        if self._state_path is None:
+            return
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(
+                {'offsets': self.offsets, 'state': self.state}, f,
+                pickle.HIGHEST_PROTOCOL
+            )
+        os.rename(tmp_path, self._state_path)
+
+    def close(self):
+        """Closes files kept open between polls."""
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _read(self, path):
+        # Drain the file opened by the previous poll first, so that lines
+        # written just before a rotation are not lost.
+        f = self._files.get(path)
+        if f is not None:
+            for line in self._read_lines(path, f):
+                yield line
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            # The file may be missing for a moment during rotation
+            return
+
+        inode, offset = self.offsets.get(path, (None, 0))
+        if f is not None and inode != st.st_ino:
+            f.close()
+            f = None
+        if f is None:
+            f = open(path, 'rb')
+            self._files[path] = f
+            if inode != st.st_ino:
+                offset = 0
+        if st.st_size < offset:
+            offset = 0
+        self.offsets[path] = (st.st_ino, offset)
+
+        for line in self._read_lines(path, f):
+            yield line
+
+    def _read_lines(self, path, f):
+        inode, offset = self.offsets[path]
+        encoding = self._encoding
+        buf = b''
+        f.seek(offset)
+        while True:
+            chunk = f.read(self._chunk_size)
+            if not chunk:
+                break
+            buf += chunk
+            end = buf.rfind(b'\n')
+            if end < 0:
+                continue
+            for line in buf[:end].split(b'\n'):
+                offset += len(line) + 1
+                self.offsets[path] = (inode, offset)
+                yield line.decode(encoding)
+            buf = buf[end + 1:]
+
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass funnel analysis over sessions.
+
+A funnel is an ordered list of steps, each written in the same
+``{{index:pattern}}`` column syntax as :class:`~loganalysis.logre.TupleRegex`.
+Instead of running one :class:`~loganalysis.logre.LogRegex` per funnel prefix,
+:class:`Funnel` walks every session once and only tests each row against the
+next step the session has not reached yet.
+"""
+
+from .logre import TupleRegex
+
+
+class Funnel(object):
+    """
+    Ordered list of steps evaluated against sessions in a single pass.
+
+    Let's say we want to know how many sessions log in, open the shop and then
+    buy something::
+
+        >>> from datetime import datetime, timedelta
+        >>> now = datetime(2015, 1, 1)
+        >>> sessions = [
+        ...     [
+        ...         (now + timedelta(minutes=0), 'alan', 'login'),
+        ...         (now + timedelta(minutes=1), 'alan', 'shop'),
+        ...         (now + timedelta(minutes=3), 'alan', 'buy'),
+        ...     ],
+        ...     [
+        ...         (now + timedelta(minutes=0), 'brad', 'login'),
+        ...         (now + timedelta(minutes=2), 'brad', 'shop'),
+        ...     ],
+        ...     [
+        ...         (now + timedelta(minutes=1), 'cate', 'shop'),
+        ...     ],
+        ... ]
+        >>> funnel = Funnel(
+        ...     [r'{{2:login}}', r'{{2:shop}}', r'{{2:buy}}'], ts_index=0
+        ... )
+
+    :meth:`progress` returns the number of steps a session reached and the
+    time spent between consecutive steps::
+
+        >>> reached, elapsed = funnel.progress(sessions[0])
+        >>> reached
+        3
+        >>> [e.seconds for e in elapsed]
+        [60, 120]
+
+    Steps must be reached in order, so Cate's session doesn't enter the funnel
+    at all::
+
+        >>> funnel.progress(sessions[2])
+        (0, [])
+
+    :meth:`count` aggregates conversion counts. The first element is the number
+    of sessions, and the `i`-th element is the number of sessions that reached
+    the `i`-th step::
+
+        >>> funnel.count(sessions)
+        [3, 2, 2, 1]
+
+    :param steps: a list of step patterns in ``{{index:pattern}}`` syntax
+    :type  steps: list
+    :param ts_index: index of timestamp column. If `None`, elapsed times are
+                     not computed.
+    :type  ts_index: int
+    :param col_sep: column separator used to encode rows
+    :type  col_sep: str
+    """
+    def __init__(self, steps, ts_index=None, col_sep='\t'):
+        self._ts_index = ts_index
+        self._matchers = [TupleRegex(p, col_sep).match for p in steps]
+        if not self._matchers:
+            raise ValueError('A funnel needs at least one step')
+
+    def __len__(self):
+        return len(self._matchers)
+
+    def progress(self, session):
+        """Returns a tuple of (number of steps reached, elapsed times between
+        consecutive steps) for a single session."""
+        matchers = self._matchers
+        n_steps = len(matchers)
+        ts_index = self._ts_index
+
+        reached = 0
+        elapsed = []
+        last_ts = None
+        for row in session:
+            if not matchers[reached](row):
+                continue
+            if ts_index is not None:
+                cur_ts = row[ts_index]
+                if last_ts is not None:
+                    elapsed.append(cur_ts - last_ts)
+                last_ts = cur_ts
+            reached += 1
+            if reached == n_steps:
+                break
+
+        return reached, elapsed
+
+    def progress_m(self, sessions):
+        """Performs progress() on each session and yields the results."""
+        progress = self.progress
+        for session in sessions:
+            yield progress(session)
+
+    def count(self, sessions):
+        """Returns a list of conversion counts. The first element is the
+        number of sessions, and the `i`-th element is the number of sessions
+        that reached the `i`-th step."""
+        histogram = [0] * (len(self._matchers) + 1)
+        for reached, _ in self.progress_m(sessions):
+            histogram[reached] += 1
+
+        # Sessions that reached step `i` also reached every step before it
+        counts = []
+        total = 0
+        for n in reversed(histogram):
+            total += n
+            counts.append(total)
+        counts.reverse()
+        return counts
@@ -4,19 +4,147 @@ A simple extension of a regular expression to denote a pattern across multiple
 lines.
 """
 
+import json
 import re
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
 from datetime import datetime
 
+from . import __version__
+
 
 _P_ROW = re.compile(r'\[\[(.+?)\]\]([^\[]*)')
 _P_COL = re.compile(r'\{\{(\d+):(.+?)\}\}')
 _DEFAULT_TIME_FORMAT = u'%Y-%m-%dT%H:%M:%S.%f'
+_P_QUANTIFIER = re.compile(r'^\s*(?:[*+?]|\{\d*(?:,\d*)?\})[?+]?')
+_ROW_GROUP = '_row%d'
+_timer = getattr(time, 'perf_counter', time.time)
+
+# Token types encode_tuple() formats as integers. bool is left out on
+# purpose.
+try:
+    _INTEGER_TYPES = (int, long)
+except NameError:  # pragma: no cover
+    _INTEGER_TYPES = (int,)
+
+# Process-wide LRU cache of compiled patterns keyed by (kind, p, col_sep),
+# where kind is 'tuple' for TupleRegex patterns, 'log' for LogRegex patterns
+# and 'log-groups' for LogRegex patterns with a named group per row group.
+_CACHE_MAX = 512
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Translated patterns loaded by load_pattern_cache(), keyed like _cache
+_translations = {}
+
+# Bumped whenever translation of patterns changes, so that translations
+# saved by save_pattern_cache() before the change aren't reused
+_TRANSLATION_FORMAT = 4
+
+
+def _compile(kind, p, col_sep):
+    """Returns a compiled regex of TupleRegex or LogRegex pattern, reusing
+    one compiled before in this process if possible"""
+    key = (kind, p, col_sep)
+    with _cache_lock:
+        entry = _cache.pop(key, None)
+        if entry is not None:
+            _cache[key] = entry
+            return entry[1]
+
+    translated = _translations.get(key)
+    if translated is None:
+        if kind == 'tuple':
+            translated = compile_tuple_pattern(p, col_sep)
+        else:
+            translated = compile_pattern(p, col_sep,
+                                         groups=kind == 'log-groups')
+    compiled = re.compile(translated, 0 if kind == 'tuple' else re.M)
+
+    with _cache_lock:
+        _cache[key] = (translated, compiled)
+        while len(_cache) > _CACHE_MAX:
+            _cache.popitem(last=False)
+    return compiled
+
+
+def purge():
+    """Clears the cache of compiled patterns"""
+    with _cache_lock:
+        _cache.clear()
+    _translations.clear()
+
+
+def save_pattern_cache(path):
+    """Writes translated patterns compiled or loaded in this process to
+    `path`, so that other processes can skip translation with
+    :func:`load_pattern_cache`. The file is tagged with the version of this
+    package and of the translation format."""
+    with _cache_lock:
+        entries = dict(_translations)
+        entries.update(
+            (key, translated) for key, (translated, _) in _cache.items()
+        )
+    with open(path, 'w') as f:
+        json.dump(
+            {
+                'version': __version__,
+                'format': _TRANSLATION_FORMAT,
+                'patterns': [
+                    list(key) + [translated]
+                    for key, translated in sorted(entries.items())
+                ],
+            },
+            f
+        )
+
+
+def load_pattern_cache(path):
+    """Reads translated patterns written by :func:`save_pattern_cache`.
+    Files written by another version of this package are ignored, as their
+    translations may be out of date.
+
+    :return: number of patterns loaded
+    """
+    with open(path) as f:
+        saved = json.load(f)
+    if not isinstance(saved, dict) or \
+            saved.get('version') != __version__ or \
+            saved.get('format') != _TRANSLATION_FORMAT:
+        return 0
+    for kind, p, col_sep, translated in saved['patterns']:
+        _translations[(kind, p, col_sep)] = translated
+    return len(saved['patterns'])
 
 
 class TupleRegex(object):
+    """
+    Compiled patterns are cached by (pattern, col_sep) in each process, and
+    pickled objects only carry the pattern and separator.
+
+    :param p: TupleRegex pattern
+    :type  p: str
+    :param col_sep: column separator used to encode rows
+    :type  col_sep: str
+    """
     def __init__(self, p, col_sep='\t'):
+        self.pattern = p
         self._col_sep = col_sep
-        self._compiled_p = re.compile(compile_tuple_pattern(p, col_sep))
+        self._compiled_p = _compile('tuple', p, col_sep)
+
+    def __getstate__(self):
+        return self.pattern, self._col_sep
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def match(self, row):
+        """Returns whether `row` matches the pattern"""
+        return self._compiled_p.match(
+            encode_tuple(row, self._col_sep)
+        ) is not None
 
     def finditer(self, logs):
         return (
@@ -48,17 +176,52 @@ def compile_tuple_pattern(p, col_sep='\t'):
 def encode_tuple(row, sep='\t'):
     encoded = []
     for token in row:
-        if type(token) == datetime:
+        # Text tokens, by far the most common ones, are checked first
+        token_type = type(token)
+        if token_type is str:
+            encoded.append(token)
+        elif token_type is datetime:
             encoded.append(token.strftime(_DEFAULT_TIME_FORMAT))
+        elif token_type is float:
+            # repr() keeps every digit of e.g. Unix timestamps on Python 2
+            encoded.append(repr(token))
+        elif token_type in _INTEGER_TYPES:
+            encoded.append(str(token))
         else:
             encoded.append(token)
     return sep.join(encoded)
 
 
 class LogRegex(object):
-    def __init__(self, p, col_sep='\t'):
+    """
+    Compiled patterns are cached by (pattern, col_sep) in each process, and
+    pickled objects only carry the pattern and separator. `metrics` is not
+    pickled.
+
+    :param p: LogRegex pattern
+    :type  p: str
+    :param col_sep: column separator used to encode rows
+    :type  col_sep: str
+    :param metrics: registry to report encode and match time, sessions and
+                    matches to, labeled with the pattern
+    :type  metrics: :class:`~loganalysis.metrics.Metrics`
+    """
+    def __init__(self, p, col_sep='\t', metrics=None):
+        self.pattern = p
         self._col_sep = col_sep
-        self._compiled_p = re.compile(compile_pattern(p, col_sep), re.M)
+        self._compiled_p = _compile('log', p, col_sep)
+        # Row groups slow matching down, so they are only compiled in once
+        # matches() needs them
+        self._grouped_p = None
+        self._instrument = None
+        if metrics is not None:
+            self._instrument = _LogRegexMetrics(metrics, p)
+
+    def __getstate__(self):
+        return self.pattern, self._col_sep
+
+    def __setstate__(self, state):
+        self.__init__(*state)
 
     def finditer(self, log):
         return (m for m in self.finditer_m([log]))
@@ -66,27 +229,461 @@ class LogRegex(object):
     def finditer_m(self, logs):
         """Performs finditer() on a list of multiple logs, each log in a list
         usually represents a single session."""
+        for log, m, starts in self._iter_matches(logs, self._compiled_p):
+            start = bisect_left(starts, m.start())
+            end = bisect_left(starts, m.end())
+            yield tuple(log[start:end])
+
+    def matches(self, log):
+        """Like finditer(), but yields :class:`LogMatch` objects carrying
+        row indices, row group spans and named captures."""
+        return self.matches_m([log])
+
+    def matches_m(self, logs):
+        """Performs matches() on a list of multiple logs."""
+        if self._grouped_p is None:
+            self._grouped_p = _compile('log-groups', self.pattern,
+                                       self._col_sep)
+        for log, m, starts in self._iter_matches(logs, self._grouped_p):
+            yield LogMatch(log, m, starts)
+
+    def _iter_matches(self, logs, compiled_p):
+        # Row offsets are computed while encoding, so that matched rows are
+        # found by bisecting them instead of scanning the matched text.
+        instrument = self._instrument
+        col_sep = self._col_sep
         for log in logs:
-            matches = self._compiled_p.finditer(encode(log))
+            if instrument is None:
+                encoded, starts = _encode_with_offsets(log, col_sep)
+                matches = compiled_p.finditer(encoded)
+            else:
+                matches, starts = instrument.finditer(
+                    compiled_p, log, col_sep
+                )
             for m in matches:
-                yield tuple(
-                    log[int(i)]
-                    for i in re.findall(r'^(\d+)\t', m.group(), re.M)
+                yield log, m, starts
+
+
+class LogMatch(object):
+    """
+    A match of :class:`LogRegex` in a log.
+
+        >>> from datetime import datetime
+        >>> log = [
+        ...     (datetime(2015, 1, 1, 0, 0), 'alan', 'login'),
+        ...     (datetime(2015, 1, 1, 0, 1), 'alan', 'stage/1'),
+        ...     (datetime(2015, 1, 1, 0, 2), 'alan', 'acquired', 'legend'),
+        ...     (datetime(2015, 1, 1, 0, 3), 'alan', 'logout'),
+        ... ]
+        >>> p = LogRegex(
+        ...     r'[[ {{2:login}} ]][[ ]]*?'
+        ...     r'[[ {{2:acquired}} {{3:(?P<item>legend|unique)}} ]]'
+        ... )
+        >>> m = next(p.matches(log))
+
+    `start` and `end` are indices of the first row and one past the last row
+    of the match in the log::
+
+        >>> m.start, m.end
+        (0, 3)
+        >>> m.rows == tuple(log[0:3])
+        True
+
+    `spans` holds (start, end) row indices of each ``[[ ]]`` row group of the
+    pattern. A repeated row group spans every row it matched::
+
+        >>> m.spans
+        [(0, 1), (1, 2), (2, 3)]
+
+    Named groups in column patterns are available as captures, or one by one
+    with :meth:`group`::
+
+        >>> print(m.captures['item'])
+        legend
+        >>> print(m.group('item'))
+        legend
+
+    If a named group is inside a repeated row group, the capture holds the
+    value from the last repetition, just like :mod:`re`.
+    """
+    __slots__ = ('log', 'start', 'end', '_match', '_starts')
+
+    def __init__(self, log, match, starts):
+        self.log = log
+        self._match = match
+        self._starts = starts
+        self.start = bisect_left(starts, match.start())
+        self.end = bisect_left(starts, match.end())
+
+    def __repr__(self):
+        return '<LogMatch rows=[%d:%d]>' % (self.start, self.end)
+
+    @property
+    def rows(self):
+        """Tuple of matched rows"""
+        return tuple(self.log[self.start:self.end])
+
+    @property
+    def indices(self):
+        """List of indices of matched rows"""
+        return list(range(self.start, self.end))
+
+    @property
+    def spans(self):
+        """List of (start, end) row indices of each row group"""
+        m = self._match
+        starts = self._starts
+        spans = []
+        i = 0
+        while True:
+            try:
+                start, end = m.span(_ROW_GROUP % i)
+            except IndexError:
+                return spans
+            if start < 0:
+                spans.append(None)
+            else:
+                spans.append(
+                    (bisect_left(starts, start), bisect_left(starts, end))
                 )
+            i += 1
+
+    @property
+    def captures(self):
+        """Dict of named groups in column patterns"""
+        return dict(
+            (name, value)
+            for name, value in self._match.groupdict().items()
+            if not _is_row_group(name)
+        )
+
+    def group(self, name):
+        """Returns a named capture"""
+        return self._match.group(name)
+
 
+def _is_row_group(name):
+    return name.startswith('_row') and name[4:].isdigit()
 
-def compile_pattern(p, col_sep='\t'):
-    """Turn LogRegex pattern into plain regex pattern"""
+
+class StreamingLogRegex(object):
+    """
+    Matches a :class:`LogRegex` pattern directly on an interleaved stream of
+    rows of many clients, without sessionizing it first.
+
+    Let's say we want an alert when a client fails twice and then succeeds
+    within 5 minutes::
+
+        >>> from datetime import datetime, timedelta
+        >>> now = datetime(2015, 1, 1)
+        >>> log = [
+        ...     (now + timedelta(minutes=0), 'alan', 'fail'),
+        ...     (now + timedelta(minutes=1), 'brad', 'fail'),
+        ...     (now + timedelta(minutes=2), 'alan', 'fail'),
+        ...     (now + timedelta(minutes=3), 'alan', 'success'),
+        ...     (now + timedelta(minutes=4), 'brad', 'fail'),
+        ...     (now + timedelta(minutes=9), 'brad', 'success'),
+        ... ]
+        >>> p = StreamingLogRegex(
+        ...     r'[[ {{2:fail}} ]]{2,}?[[ {{2:success}} ]]',
+        ...     ts_index=0, cid_index=1, window=timedelta(minutes=5)
+        ... )
+
+    Matches are yielded as (cid, :class:`LogMatch`) tuples as soon as the row
+    completing them arrives. Brad's rows don't match since they span more
+    than 5 minutes::
+
+        >>> [(cid, len(m.rows)) for cid, m in p.finditer(log)]
+        [('alan', 3)]
+
+    Each row group of the pattern is matched against one row at a time. For
+    each client, the matcher keeps the positions in the pattern reachable by
+    its recent rows, together with the rows partial matches at each position
+    started at. Rows before the earliest start are dropped, so a row that
+    can't begin or extend a match is never kept. Starts older than `window`
+    relative to the latest row of the stream are dropped as well, and so are
+    clients without any. Memory is thus proportional to partial matches in
+    flight rather than to session size. The full pattern is only run once
+    per match, on the matched rows, to find row group spans and captures.
+
+    Only patterns made of row groups, each optionally followed by a
+    quantifier such as ``*?``, ``+?`` or ``{2}``, are supported. Quantifiers
+    matching a varying number of rows must be lazy, except on the last row
+    group. Other patterns raise :exc:`ValueError`.
+
+    A match is reported as soon as a row completes it. Of the matches
+    completed by a row, the one starting first is reported. This is the match
+    :class:`LogRegex` finds as well, since lazy row groups match as few rows
+    as possible there too. The exception is a greedy quantifier on the last
+    row group, which matches as few rows as possible here, e.g. ``[[ ]]*`` at
+    the end of a pattern never consumes a row. Matches of the same client
+    don't overlap, and ``match.log`` holds the matched rows.
+
+    The stream should be ordered by timestamp, like for
+    :func:`~loganalysis.utils.sessionize`.
+
+    :param p: LogRegex pattern
+    :type  p: str
+    :param ts_index: index of timestamp column
+    :type  ts_index: int
+    :param cid_index: index of client id column
+    :type  cid_index: int
+    :param window: maximum time span of a match
+    :type  window: :class:`~datetime.timedelta`
+    :param col_sep: column separator used to encode rows
+    :type  col_sep: str
+    """
+    def __init__(self, p, ts_index, cid_index, window, col_sep='\t'):
+        self.pattern = p
+        self._ts_index = ts_index
+        self._cid_index = cid_index
+        self._window = window
+        self._col_sep = col_sep
+        self._steps = _row_steps(p, col_sep)
+        self._compiled_p = re.compile(
+            r'(?:%s)\Z' % compile_pattern(p, col_sep, groups=True), re.M
+        )
+
+        # cid -> [last timestamp, number of the first row kept, rows kept,
+        # states], ordered by last update. States hold a dict for each row
+        # group, mapping the number of rows matched by the row group to an
+        # ascending tuple of numbers of rows partial matches started at.
+        self._partials = OrderedDict()
+
+    def __len__(self):
+        """Number of clients with partial matches in flight"""
+        return len(self._partials)
+
+    @property
+    def n_rows(self):
+        """Number of rows kept for partial matches in flight"""
+        return sum(len(partial[2]) for partial in self._partials.values())
+
+    def finditer(self, log):
+        """Performs feed() on each row, yielding (cid, match) tuples."""
+        feed = self.feed
+        for row in log:
+            for match in feed(row):
+                yield match
+
+    def feed(self, row):
+        """Advances the matcher by a row and returns a list of (cid, match)
+        tuples completed by the row."""
+        cur_ts = row[self._ts_index]
+        cid = row[self._cid_index]
+        window = self._window
+        ts_index = self._ts_index
+        steps = self._steps
+        partials = self._partials
+
+        # Move the client to the end, as it is the most recently updated one
+        partial = partials.pop(cid, None)
+        if partial is None:
+            partial = [None, 0, [], [{} for _ in steps]]
+        partial[0] = cur_ts
+        partials[cid] = partial
+
+        # Expire clients without rows within the window
+        while True:
+            oldest = next(iter(partials))
+            if cur_ts - partials[oldest][0] <= window:
+                break
+            del partials[oldest]
+
+        _, first, rows, states = partial
+        n = first + len(rows)
+        rows.append(row)
+
+        # Drop starts of partial matches older than the window
+        for group in states:
+            for count, starts in list(group.items()):
+                expired = 0
+                for start in starts:
+                    if cur_ts - rows[start - first][ts_index] <= window:
+                        break
+                    expired += 1
+                if expired == len(starts):
+                    del group[count]
+                elif expired:
+                    group[count] = starts[expired:]
+
+        # Start a partial match at this row, skipping optional row groups
+        for i, (_, min_count, _) in enumerate(steps):
+            _add_starts(states[i], 0, (n,))
+            if min_count > 0:
+                break
+
+        # Advance partial matches by this row
+        line = '0' + self._col_sep + encode_tuple(row, self._col_sep) + '\n'
+        next_states = [{} for _ in steps]
+        for i, group in enumerate(states):
+            if not group:
+                continue
+            match_row, min_count, max_count = steps[i]
+            if match_row(line) is None:
+                continue
+            for count, starts in group.items():
+                if max_count is not None and count >= max_count:
+                    continue
+                # Counts above the minimum are alike for an unbounded group
+                count += 1
+                if max_count is None:
+                    count = min(count, min_count)
+                _add_starts(next_states[i], count, starts)
+
+        completed = self._close(next_states)
+        if completed:
+            del partials[cid]
+            return [(cid, self._match(rows[completed[0] - first:]))]
+
+        heads = [
+            starts[0] for group in next_states for starts in group.values()
+        ]
+        if not heads:
+            del partials[cid]
+            return []
+        earliest = min(heads)
+        del rows[:earliest - first]
+        partial[1] = earliest
+        partial[3] = next_states
+        return []
+
+    def _close(self, states):
+        # Adds starts to the states reachable without another row, and
+        # returns starts of partial matches reaching the end of the pattern
+        steps = self._steps
+        completed = ()
+        for i, group in enumerate(states):
+            min_count = steps[i][1]
+            starts = ()
+            for count, group_starts in group.items():
+                if count >= min_count:
+                    starts = _merge_starts(starts, group_starts)
+            if not starts:
+                continue
+            if i + 1 == len(steps):
+                completed = starts
+            else:
+                _add_starts(states[i + 1], 0, starts)
+        return completed
+
+    def _match(self, rows):
+        encoded, starts = _encode_with_offsets(rows, self._col_sep)
+        return LogMatch(rows, self._compiled_p.match(encoded), starts)
+
+
+def _add_starts(group, count, starts):
+    group[count] = _merge_starts(group.get(count, ()), starts)
+
+
+def _merge_starts(a, b):
+    # Merges ascending tuples of row numbers. New starts usually come after
+    # known ones, so they are appended without sorting.
+    if not a:
+        return b
+    if not b or a[-1] < b[0]:
+        return a + b
+    if b[-1] < a[0]:
+        return b + a
+    return tuple(sorted(set(a).union(b)))
+
+
+# Quantifier following a row group in patterns of StreamingLogRegex
+_P_STREAM_QUANTIFIER = re.compile(
+    r'^(?:(?P<symbol>[*+?])|\{(?P<min>\d*)(?P<comma>,?)(?P<max>\d*)\})'
+    r'(?P<lazy>\?)?$'
+)
+
+
+def _row_steps(p, col_sep):
+    """Returns a list of (row matcher, minimum count, maximum count) for each
+    row group of LogRegex pattern. Maximum count is `None` if unbounded."""
+    steps = []
+    m_rows = list(re.finditer(_P_ROW, p))
+    for row_index, m_row in enumerate(m_rows):
+        cols, modifier = m_row.groups()
+        if not modifier:
+            min_count, max_count = 1, 1
+        else:
+            m = _P_STREAM_QUANTIFIER.match(modifier)
+            if m is None or m.group(0) == '{}':
+                raise ValueError(
+                    'Unsupported modifier of row group: %r' % modifier
+                )
+            symbol = m.group('symbol')
+            if symbol is not None:
+                min_count, max_count = {
+                    '*': (0, None), '+': (1, None), '?': (0, 1),
+                }[symbol]
+            else:
+                min_count = int(m.group('min') or 0)
+                max_count = m.group('max')
+                if max_count:
+                    max_count = int(max_count)
+                elif m.group('comma'):
+                    max_count = None
+                else:
+                    max_count = min_count
+            # A greedy row group followed by others would have to consume as
+            # many rows as possible before the rest of the pattern, which a
+            # match reported on completion can't do
+            if max_count != min_count and m.group('lazy') is None and \
+                    row_index < len(m_rows) - 1:
+                raise ValueError(
+                    'Greedy quantifier on a row group other than the last '
+                    'one, use %r instead: %r' % (modifier + '?', modifier)
+                )
+        row_p = re.compile(compile_pattern('[[%s]]' % cols, col_sep), re.M)
+        steps.append((row_p.match, min_count, max_count))
+    if not steps:
+        raise ValueError('Pattern has no row group: %r' % p)
+    return steps
+
+
+class _LogRegexMetrics(object):
+    def __init__(self, metrics, p):
+        self.metrics = metrics
+        self.encode_metric = metrics.histogram('logregex_encode_seconds',
+                                               pattern=p)
+        self.match_metric = metrics.histogram('logregex_match_seconds',
+                                              pattern=p)
+        self.sessions_metric = metrics.counter('logregex_sessions_total',
+                                               pattern=p)
+        self.matches_metric = metrics.counter('logregex_matches_total',
+                                              pattern=p)
+
+    def finditer(self, compiled_p, log, col_sep):
+        """Encodes log and returns a list of matches and row offsets, timing
+        each step"""
+        started = _timer()
+        encoded, starts = _encode_with_offsets(log, col_sep)
+        encoded_at = _timer()
+        matches = list(compiled_p.finditer(encoded))
+        self.encode_metric.observe(encoded_at - started)
+        self.match_metric.observe(_timer() - encoded_at)
+        self.sessions_metric.inc()
+        self.matches_metric.inc(len(matches))
+        self.metrics.maybe_flush()
+        return matches, starts
+
+
+def compile_pattern(p, col_sep='\t', groups=False):
+    """Turn LogRegex pattern into plain regex pattern
+
+    If `groups` is `True`, each row group and its quantifier is wrapped in a
+    named group, so that rows matched by each row group can be told."""
     row_regexes = []
 
     # Each row in LogRegex pattern
     m_rows = list(re.finditer(_P_ROW, p))
-    for m_row in m_rows:
+    for row_index, m_row in enumerate(m_rows):
+        if groups:
+            row_regexes.append(r'(?P<%s>' % (_ROW_GROUP % row_index))
         row_regexes.append(r'(^')
         cols, modifier = m_row.groups()
         last_index = 0
 
-        col_regexes = ['\d+']
+        col_regexes = [r'\d+']
 
         # Each col in LogRegex's row pattern
         m_cols = list(re.finditer(_P_COL, cols))
@@ -102,9 +699,15 @@ def compile_pattern(p, col_sep='\t'):
             last_index += 1
 
         encoded_col_sep = col_sep.encode('unicode-escape').decode('utf-8')
+        if groups:
+            m_quantifier = _P_QUANTIFIER.match(modifier)
+            quantifier_end = m_quantifier.end() if m_quantifier else 0
+            modifier = (
+                modifier[:quantifier_end] + ')' + modifier[quantifier_end:]
+            )
         row_regexes.append(
             encoded_col_sep.join(col_regexes) +
-            r'(\t.+)?\n)' +
+            r'(' + encoded_col_sep + r'.+)?\n)' +
             modifier
         )
 
@@ -118,3 +721,18 @@ def encode(log, sep='\t'):
         str(i) + sep + encode_tuple(row, sep)
         for i, row in enumerate(log)
     ) + '\n'
+
+
+def _encode_with_offsets(log, sep):
+    """Same as encode(), but also returns a list of offsets where each row
+    starts in the encoded string"""
+    lines = [
+        str(i) + sep + encode_tuple(row, sep) + '\n'
+        for i, row in enumerate(log)
+    ]
+    starts = []
+    offset = 0
+    for line in lines:
+        starts.append(offset)
+        offset += len(line)
+    return ''.join(lines), starts
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Optional instrumentation of the streaming pipeline.
+
+Functions and classes accepting a `metrics` argument, such as
+:func:`~loganalysis.utils.sessionize` and :class:`~loganalysis.logre.LogRegex`,
+report what happens inside them to a :class:`Metrics` registry. When the
+argument is omitted, nothing is measured and the only cost is a `None` check.
+
+    >>> metrics = Metrics()
+    >>> rows = metrics.counter('rows_total', stage='read')
+    >>> rows.inc()
+    >>> rows.inc(2)
+    >>> metrics.gauge('open_sessions').set(5)
+    >>> for line in metrics.render().splitlines():
+    ...     print(line)
+    # TYPE open_sessions gauge
+    open_sessions 5
+    # TYPE rows_total counter
+    rows_total{stage="read"} 3
+
+The registry hands collected values over to sinks. A sink is any callable
+taking a :class:`Metrics` object, e.g. a function passed as a callback,
+:class:`LogSink` or :class:`PrometheusFileSink`.
+"""
+
+import logging
+import os
+import time
+from bisect import bisect_left
+
+
+#: Default histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.00001, 0.0001, 0.001, 0.01, 0.1, 1.0, 10.0,
+)
+
+
+class Counter(object):
+    """Monotonically increasing value"""
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, value=1):
+        self.value += value
+
+    def samples(self):
+        return [('', (), self.value)]
+
+
+class Gauge(object):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        return [('', (), self.value)]
+
+
+class Histogram(object):
+    """Distribution of observed values over fixed buckets"""
+    kind = 'histogram'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            samples.append(('_bucket', (('le', repr(bound)),), cumulative))
+        samples.append(('_bucket', (('le', '+Inf'),), self.count))
+        samples.append(('_count', (), self.count))
+        samples.append(('_sum', (), self.sum))
+        return samples
+
+
+class Metrics(object):
+    """
+    Registry of counters, gauges and histograms.
+
+    A metric is identified by its name and labels. Asking for the same metric
+    twice returns the same object, so callers look metrics up once and keep
+    them.
+
+    :param sinks: callables taking this object, called by :meth:`flush`
+    :type  sinks: list
+    :param interval: minimum seconds between flushes triggered by
+                     :meth:`maybe_flush`
+    :type  interval: float
+    """
+    def __init__(self, sinks=(), interval=10.0):
+        self.sinks = list(sinks)
+        self.interval = interval
+        self._metrics = {}
+        self._last_flush = time.time()
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, buckets)
+
+    def _get(self, cls, name, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = cls(*args)
+            self._metrics[key] = metric
+        elif not isinstance(metric, cls):
+            raise ValueError('%s is already registered as a %s'
+                             % (name, metric.kind))
+        return metric
+
+    def collect(self):
+        """Returns a sorted list of (name, labels, metric) tuples where
+        labels is a tuple of (key, value) pairs."""
+        return [
+            (name, labels, metric)
+            for (name, labels), metric in sorted(
+                self._metrics.items(), key=lambda kv: kv[0]
+            )
+        ]
+
+    def render(self):
+        """Returns metrics in Prometheus text exposition format."""
+        lines = []
+        last_name = None
+        for name, labels, metric in self.collect():
+            if name != last_name:
+                lines.append('# TYPE %s %s' % (name, metric.kind))
+                last_name = name
+            for suffix, extra_labels, value in metric.samples():
+                lines.append('%s%s %s' % (
+                    name + suffix, _format_labels(labels + extra_labels),
+                    _format_value(value)
+                ))
+        return ''.join(line + '\n' for line in lines)
+
+    def flush(self):
+        """Passes this object to every sink."""
+        self._last_flush = time.time()
+        for sink in self.sinks:
+            sink(self)
+
+    def maybe_flush(self):
+        """Calls :meth:`flush` if `interval` seconds have passed since the
+        last flush."""
+        if time.time() - self._last_flush >= self.interval:
+            self.flush()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class LogSink(object):
+    """
+    Sink writing every metric in a single log line.
+
+    :param logger: logger to write to. Defaults to the ``loganalysis`` logger.
+    :type  logger: :class:`logging.Logger`
+    :param level: logging level
+    :type  level: int
+    """
+    def __init__(self, logger=None, level=logging.INFO):
+        self._logger = logger or logging.getLogger('loganalysis')
+        self._level = level
+
+    def __call__(self, metrics):
+        parts = []
+        for name, labels, metric in metrics.collect():
+            if metric.kind == 'histogram':
+                value = '%d/%s' % (metric.count, _format_value(metric.sum))
+            else:
+                value = _format_value(metric.value)
+            parts.append('%s%s=%s' % (name, _format_labels(labels), value))
+        self._logger.log(self._level, 'metrics %s', ' '.join(parts))
+
+
+class PrometheusFileSink(object):
+    """
+    Sink writing metrics to a file in Prometheus text exposition format, e.g.
+    for the textfile collector of node_exporter. The file is replaced
+    atomically, so readers never see a partial file.
+
+    :param path: path of file to write
+    :type  path: str
+    """
+    def __init__(self, path):
+        self._path = path
+
+    def __call__(self, metrics):
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(metrics.render())
+        os.rename(tmp_path, self._path)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded-memory mining of the most frequent navigation paths.
+
+Counting every path exactly needs memory proportional to the number of
+distinct paths. :class:`SpaceSaving` keeps a fixed number of counters instead,
+and reports each count together with an upper bound on its overestimation.
+"""
+
+import heapq
+from collections import deque
+
+
+class SpaceSaving(object):
+    """
+    Approximate heavy-hitter counter using the Space-Saving algorithm.
+
+    At most `capacity` items are tracked. When a new item arrives and every
+    counter is in use, the item with the smallest count is replaced and the
+    new item inherits its count as an error::
+
+        >>> counter = SpaceSaving(2)
+        >>> for item in ['a', 'b', 'a', 'c', 'a']:
+        ...     counter.update(item)
+        >>> counter.top(2)
+        [('a', 3, 0), ('c', 2, 1)]
+
+    Each entry of :meth:`top` is a tuple of (item, count, error). The true
+    count of the item lies between ``count - error`` and ``count``, and any
+    item whose true count exceeds ``total / capacity`` is guaranteed to be
+    tracked.
+
+    Summaries built from disjoint parts of a stream, e.g. by parallel workers,
+    can be combined with :meth:`merge`::
+
+        >>> other = SpaceSaving(2)
+        >>> for item in ['b', 'b', 'b']:
+        ...     other.update(item)
+        >>> counter.merge(other).top(1)
+        [('b', 5, 2)]
+
+    :param capacity: maximum number of items to track
+    :type  capacity: int
+    """
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('capacity should be a positive integer')
+        self.capacity = capacity
+        self.total = 0
+
+        # item -> [count, error]
+        self._counters = {}
+
+        # Heap of (count, seq, item). Counts in the heap are lower bounds of
+        # the actual counts and are refreshed lazily in _pop_min().
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._counters)
+
+    def __contains__(self, item):
+        return item in self._counters
+
+    def update(self, item, count=1):
+        """Counts `count` occurrences of `item`."""
+        self.total += count
+        counters = self._counters
+
+        counter = counters.get(item)
+        if counter is not None:
+            counter[0] += count
+            return
+
+        if len(counters) < self.capacity:
+            error = 0
+        else:
+            evicted, error = self._pop_min()
+            del counters[evicted]
+        counters[item] = [error + count, error]
+        self._seq += 1
+        heapq.heappush(self._heap, (error + count, self._seq, item))
+
+    def min_count(self):
+        """Returns the smallest tracked count, or 0 if there is a free
+        counter."""
+        if len(self._counters) < self.capacity:
+            return 0
+        self._refresh_min()
+        return self._heap[0][0]
+
+    def top(self, k=None):
+        """Returns a list of (item, count, error) tuples ordered by count in
+        descending order."""
+        items = sorted(
+            self._counters.items(), key=lambda kv: kv[1][0], reverse=True
+        )
+        if k is not None:
+            items = items[:k]
+        return [(item, c, e) for item, (c, e) in items]
+
+    def merge(self, other):
+        """Returns a new summary combining this summary and `other`."""
+        capacity = max(self.capacity, other.capacity)
+        min_self = self.min_count()
+        min_other = other.min_count()
+
+        # An item missing from a full summary may have been counted up to its
+        # minimum count before eviction.
+        merged = {}
+        for item in set(self._counters) | set(other._counters):
+            c1, e1 = self._counters.get(item, (min_self, min_self))
+            c2, e2 = other._counters.get(item, (min_other, min_other))
+            merged[item] = (c1 + c2, e1 + e2)
+
+        result = SpaceSaving(capacity)
+        result.total = self.total + other.total
+        kept = heapq.nlargest(
+            capacity, merged.items(), key=lambda kv: kv[1][0]
+        )
+        for seq, (item, (c, e)) in enumerate(kept):
+            result._counters[item] = [c, e]
+            result._heap.append((c, seq, item))
+        result._seq = len(kept)
+        heapq.heapify(result._heap)
+        return result
+
+    def _refresh_min(self):
+        heap = self._heap
+        counters = self._counters
+        while True:
+            count, seq, item = heap[0]
+            current = counters[item][0]
+            if current == count:
+                return
+            heapq.heapreplace(heap, (current, seq, item))
+
+    def _pop_min(self):
+        self._refresh_min()
+        count, _, item = heapq.heappop(self._heap)
+        return item, count
+
+
+class TopPaths(object):
+    """
+    Streaming top-K miner of event paths, i.e. n-grams of an event column
+    within each session.
+
+        >>> sessions = [
+        ...     [('alan', 'login'), ('alan', 'shop'), ('alan', 'buy')],
+        ...     [('brad', 'login'), ('brad', 'shop'), ('brad', 'logout')],
+        ...     [('cate', 'shop')],
+        ... ]
+        >>> paths = TopPaths(2, 1, capacity=100)
+        >>> paths.update_m(sessions)
+        >>> paths.top(1)
+        [(('login', 'shop'), 2, 0)]
+
+    Sessions shorter than `n` don't contain any path. Memory is bounded by
+    `capacity` regardless of the number of distinct paths. See
+    :class:`SpaceSaving` for the meaning of counts and errors.
+
+    :param n: number of events in a path
+    :type  n: int
+    :param event_index: index of event column
+    :type  event_index: int
+    :param capacity: maximum number of paths to track
+    :type  capacity: int
+    """
+    def __init__(self, n, event_index, capacity=1000):
+        self._n = n
+        self._event_index = event_index
+        self._counter = SpaceSaving(capacity)
+
+    @property
+    def total(self):
+        """Number of paths counted so far"""
+        return self._counter.total
+
+    def update(self, session):
+        """Counts every path in a single session."""
+        n = self._n
+        event_index = self._event_index
+        update = self._counter.update
+        window = deque(maxlen=n)
+        for row in session:
+            window.append(row[event_index])
+            if len(window) == n:
+                update(tuple(window))
+
+    def update_m(self, sessions):
+        """Performs update() on each session."""
+        for session in sessions:
+            self.update(session)
+
+    def top(self, k=None):
+        """Returns a list of (path, count, error) tuples ordered by count in
+        descending order."""
+        return self._counter.top(k)
+
+    def merge(self, other):
+        """Returns a new miner combining this miner and `other`, e.g. partial
+        results from parallel workers."""
+        if self._n != other._n or self._event_index != other._event_index:
+            raise ValueError('Cannot merge miners with different paths')
+        result = TopPaths(self._n, self._event_index, self._counter.capacity)
+        result._counter = self._counter.merge(other._counter)
+        return result
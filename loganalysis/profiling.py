@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Finding the sessions that make matching slow.
+
+:class:`SessionProfiler` times :class:`~loganalysis.logre.LogRegex` and
+:func:`~loganalysis.utils.fsm` on each session and keeps the slowest sessions
+per pattern or state machine. The kept sessions can be dumped to disk and
+replayed later with :func:`replay`, e.g. against a new version of the library.
+"""
+
+import hashlib
+import heapq
+import pickle
+import time
+from collections import namedtuple
+
+from .logre import LogRegex
+from .utils import fsm
+
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+#: A recorded session. `target` is what processed the session: the
+#: :class:`~loganalysis.logre.LogRegex`, or the (event_index, init_state,
+#: table) arguments of :meth:`SessionProfiler.fsm`.
+SlowSession = namedtuple(
+    'SlowSession', ['key', 'seconds', 'cid', 'length', 'session', 'target']
+)
+
+
+class SessionProfiler(object):
+    """
+    Keeps the `n` slowest sessions per pattern or state machine.
+
+    ::
+
+        profiler = SessionProfiler(n=10)
+        sessions = sessionize(log, 0, 1, timeout)
+        for cid, match in profiler.finditer_m(LogRegex(p), sessions):
+            ...
+        for slow in profiler.slowest(p):
+            print(slow.seconds, slow.cid, slow.length)
+        profiler.dump('slow-sessions.pickle')
+
+        for slow in load('slow-sessions.pickle'):
+            replay(slow)
+
+    Sessions are timed one by one, so matching runs slightly slower while
+    profiling. Memory is bounded by `n` sessions per key.
+
+    :param n: number of sessions to keep per key, at least 1
+    :type  n: int
+    """
+    def __init__(self, n=10):
+        if n < 1:
+            raise ValueError('n should be positive')
+        self._n = n
+        # key -> min-heap of (seconds, seq, SlowSession)
+        self._heaps = {}
+        self._seq = 0
+
+    def finditer_m(self, regex, sessions):
+        """Performs :meth:`~loganalysis.logre.LogRegex.finditer` on each
+        (cid, session) tuple from :func:`~loganalysis.utils.sessionize`,
+        yielding (cid, match) tuples. Sessions are keyed by the pattern of
+        `regex`."""
+        for cid, session in sessions:
+            started = _timer()
+            matches = list(regex.finditer(session))
+            self.record(regex.pattern, _timer() - started, cid, session,
+                        regex)
+            for match in matches:
+                yield cid, match
+
+    def fsm(self, session, event_index, init_state, table, cid=None,
+            key=None):
+        """Runs :func:`~loganalysis.utils.fsm` over the `event_index` column
+        of a session and returns a list of actions. Sessions are keyed by
+        `key`, which should name the state machine. If `key` is `None`, it is
+        derived from `event_index`, `init_state` and `table`, so that each
+        state machine is keyed separately."""
+        if key is None:
+            key = fsm_key(event_index, init_state, table)
+        started = _timer()
+        actions = list(
+            fsm((row[event_index] for row in session), init_state, table)
+        )
+        self.record(key, _timer() - started, cid, session,
+                    (event_index, init_state, table))
+        return actions
+
+    def record(self, key, seconds, cid, session, target=None):
+        """Records a session that took `seconds` to process. `target` is
+        stored as :attr:`SlowSession.target` for :func:`replay`."""
+        heap = self._heaps.setdefault(key, [])
+        if len(heap) >= self._n and seconds <= heap[0][0]:
+            return
+        self._seq += 1
+        entry = (seconds, self._seq,
+                 SlowSession(key, seconds, cid, len(session), session,
+                             target))
+        if len(heap) < self._n:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heapreplace(heap, entry)
+
+    def keys(self):
+        """Returns keys of recorded sessions."""
+        return sorted(self._heaps)
+
+    def slowest(self, key=None):
+        """Returns a list of :class:`SlowSession` tuples, slowest first. If
+        `key` is `None`, sessions of every key are returned."""
+        keys = self.keys() if key is None else [key]
+        result = []
+        for k in keys:
+            entries = sorted(self._heaps.get(k, []), reverse=True)
+            result.extend(entry[2] for entry in entries)
+        return result
+
+    def dump(self, path):
+        """Writes every recorded session to `path`. Read them back with
+        :func:`load`."""
+        with open(path, 'wb') as f:
+            pickle.dump(
+                [tuple(slow) for slow in self.slowest()], f,
+                pickle.HIGHEST_PROTOCOL
+            )
+
+
+def fsm_key(event_index, init_state, table):
+    """Returns the key :meth:`SessionProfiler.fsm` uses for a state machine
+    when none is given."""
+    # Items are sorted by repr() since states and events may mix types
+    items = sorted(repr(item) for item in table.items())
+    digest = hashlib.md5(
+        repr((event_index, init_state, items)).encode('utf-8')
+    ).hexdigest()
+    return 'fsm:' + digest[:12]
+
+
+def replay(slow):
+    """Processes a :class:`SlowSession` again with its target, returning a
+    list of matches for :class:`~loganalysis.logre.LogRegex` sessions or a
+    list of actions for :meth:`SessionProfiler.fsm` sessions."""
+    if isinstance(slow.target, LogRegex):
+        return list(slow.target.finditer(slow.session))
+    if slow.target is None:
+        raise ValueError('session %r was recorded without a target'
+                         % (slow.key,))
+    event_index, init_state, table = slow.target
+    return list(
+        fsm((row[event_index] for row in slow.session), init_state, table)
+    )
+
+
+def load(path):
+    """Reads sessions written by :meth:`SessionProfiler.dump` and returns a
+    list of :class:`SlowSession` tuples."""
+    with open(path, 'rb') as f:
+        return [SlowSession(*slow) for slow in pickle.load(f)]
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Local network receiver feeding rows into the streaming pipeline.
+
+:class:`Receiver` listens on localhost for syslog-style UDP datagrams and
+line-delimited TCP streams, and hands rows over to a single consumer, such as
+:func:`~loganalysis.utils.sessionize`, through a bounded queue. :func:`send` is
+a stand-in sender for load testing.
+"""
+
+import socket
+import threading
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+
+# Put into the queue after every network thread has exited
+_END = object()
+
+
+class Receiver(object):
+    """
+    Receives lines over UDP and TCP and yields them as rows.
+
+    ::
+
+        receiver = Receiver(udp_port=5140, tcp_port=5141)
+        receiver.start()
+        for cid, session in sessionize(receiver.rows(), 0, 1, timeout):
+            ...
+
+    Each line is split by `col_sep` into a tuple. A UDP datagram may carry
+    one or more lines, while a TCP stream carries any number of lines.
+
+    Network threads collect rows into batches of up to `batch_size` rows and
+    put the batches into a queue holding at most `maxsize` batches, so the
+    queue is touched once per batch rather than once per row. A partial batch
+    is flushed after `batch_timeout` seconds without new data. When the queue
+    is full, TCP readers block and TCP flow control slows senders down. UDP
+    has no flow control, so batches that don't fit are dropped and counted in
+    :attr:`dropped`.
+
+    :param host: address to listen on
+    :type  host: str
+    :param udp_port: UDP port to listen on. 0 picks a free port, and `None`
+                     disables UDP.
+    :type  udp_port: int
+    :param tcp_port: TCP port to listen on. 0 picks a free port, and `None`
+                     disables TCP.
+    :type  tcp_port: int
+    :param maxsize: maximum number of batches waiting for the consumer
+    :type  maxsize: int
+    :param batch_size: maximum number of rows in a batch
+    :type  batch_size: int
+    :param batch_timeout: seconds to wait before flushing a partial batch
+    :type  batch_timeout: float
+    :param col_sep: column separator
+    :type  col_sep: str
+    :param encoding: encoding of incoming lines
+    :type  encoding: str
+    """
+    def __init__(self, host='127.0.0.1', udp_port=None, tcp_port=None,
+                 maxsize=1024, batch_size=256, batch_timeout=0.1,
+                 col_sep='\t', encoding='utf-8'):
+        self._host = host
+        self._udp_port = udp_port
+        self._tcp_port = tcp_port
+        self._batch_size = batch_size
+        self._batch_timeout = batch_timeout
+        self._col_sep = col_sep
+        self._encoding = encoding
+
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._finished = threading.Event()
+        self._threads = []
+        self._udp_socket = None
+        self._tcp_socket = None
+
+        #: number of rows put into the queue
+        self.received = 0
+
+        #: number of rows dropped because the queue was full
+        self.dropped = 0
+
+    @property
+    def udp_address(self):
+        """(host, port) the UDP socket is bound to"""
+        return self._udp_socket.getsockname()
+
+    @property
+    def tcp_address(self):
+        """(host, port) the TCP socket is bound to"""
+        return self._tcp_socket.getsockname()
+
+    def start(self):
+        """Binds sockets and starts network threads."""
+        if self._udp_port is not None:
+            self._udp_socket = socket.socket(socket.AF_INET,
+                                             socket.SOCK_DGRAM)
+            self._udp_socket.setsockopt(socket.SOL_SOCKET,
+                                        socket.SO_RCVBUF, 1 << 22)
+            self._udp_socket.bind((self._host, self._udp_port))
+            self._udp_socket.settimeout(self._batch_timeout)
+            self._spawn(self._serve_udp)
+
+        if self._tcp_port is not None:
+            self._tcp_socket = socket.socket(socket.AF_INET,
+                                             socket.SOCK_STREAM)
+            self._tcp_socket.setsockopt(socket.SOL_SOCKET,
+                                        socket.SO_REUSEADDR, 1)
+            self._tcp_socket.bind((self._host, self._tcp_port))
+            self._tcp_socket.listen(16)
+            self._tcp_socket.settimeout(self._batch_timeout)
+            self._spawn(self._serve_tcp)
+
+    def stop(self):
+        """Stops network threads and closes sockets. Rows already in the
+        queue are still yielded by :meth:`rows`."""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        for sock in (self._udp_socket, self._tcp_socket):
+            if sock is not None:
+                sock.close()
+
+        # No thread puts batches any more, so the stream can be ended
+        self._finished.set()
+        try:
+            self._queue.put_nowait(_END)
+        except queue.Full:
+            # rows() ends once it drains the queue and sees _finished
+            pass
+
+    def rows(self):
+        """Yields received rows until the receiver is stopped and the queue
+        is drained."""
+        q = self._queue
+        while True:
+            try:
+                batch = q.get(timeout=self._batch_timeout)
+            except queue.Empty:
+                if self._finished.is_set():
+                    return
+                continue
+            if batch is _END:
+                return
+            for row in batch:
+                yield row
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _put(self, batch, block):
+        while True:
+            try:
+                self._queue.put(batch, block, self._batch_timeout)
+                break
+            except queue.Full:
+                # Give up blocking once stopped, as the consumer may be gone
+                if not block or self._stopped.is_set():
+                    with self._lock:
+                        self.dropped += len(batch)
+                    return
+        with self._lock:
+            self.received += len(batch)
+
+    def _serve_udp(self):
+        sock = self._udp_socket
+        batch = []
+        for data in self._recv_loop(sock.recv, 65536):
+            if data is not None:
+                batch.extend(self._parse(data.split(b'\n')))
+                if len(batch) < self._batch_size:
+                    continue
+            if batch:
+                self._put(batch, False)
+                batch = []
+
+    def _serve_tcp(self):
+        sock = self._tcp_socket
+        while not self._stopped.is_set():
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                return
+            conn.settimeout(self._batch_timeout)
+            self._spawn(self._serve_tcp_connection, conn)
+
+    def _serve_tcp_connection(self, conn):
+        batch = []
+        buf = b''
+        closed = False
+        try:
+            for data in self._recv_loop(conn.recv, 65536):
+                if data is not None:
+                    if not data:
+                        closed = True
+                        break
+                    buf += data
+                    end = buf.rfind(b'\n')
+                    if end >= 0:
+                        batch.extend(self._parse(buf[:end].split(b'\n')))
+                        buf = buf[end + 1:]
+                    if len(batch) < self._batch_size:
+                        continue
+                if batch:
+                    self._put(batch, True)
+                    batch = []
+        finally:
+            conn.close()
+
+        # The last line of a stream closed by the peer may lack a newline.
+        # If the receiver was stopped instead, the line may be incomplete.
+        if closed:
+            batch.extend(self._parse([buf]))
+        if batch:
+            self._put(batch, True)
+
+    def _recv_loop(self, recv, bufsize):
+        # Yields received data, or None when batch_timeout expires
+        while not self._stopped.is_set():
+            try:
+                yield recv(bufsize)
+            except socket.timeout:
+                yield None
+            except socket.error:
+                return
+
+    def _parse(self, lines):
+        encoding = self._encoding
+        col_sep = self._col_sep
+        return [
+            tuple(line.decode(encoding).rstrip(u'\r').split(col_sep))
+            for line in lines if line
+        ]
+
+
+def send(lines, port, host='127.0.0.1', protocol='udp', lines_per_packet=1,
+         encoding='utf-8'):
+    """
+    Sends lines to a :class:`Receiver`. Intended as a stand-in for real
+    collectors when load testing.
+
+    :param lines: an iterable of lines without trailing newlines
+    :type  lines: iterable
+    :param port: port of the receiver
+    :type  port: int
+    :param host: host of the receiver
+    :type  host: str
+    :param protocol: ``'udp'`` or ``'tcp'``
+    :type  protocol: str
+    :param lines_per_packet: number of lines in each UDP datagram or TCP write
+    :type  lines_per_packet: int
+
+    :return: number of lines sent
+    """
+    if protocol == 'udp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        def write(data):
+            sock.sendto(data, (host, port))
+    elif protocol == 'tcp':
+        sock = socket.create_connection((host, port))
+        write = sock.sendall
+    else:
+        raise ValueError('Unknown protocol: %s' % protocol)
+
+    n_lines = 0
+    packet = []
+    try:
+        for line in lines:
+            packet.append(line)
+            n_lines += 1
+            if len(packet) >= lines_per_packet:
+                write((u'\n'.join(packet) + u'\n').encode(encoding))
+                packet = []
+        if packet:
+            write((u'\n'.join(packet) + u'\n').encode(encoding))
+    finally:
+        sock.close()
+    return n_lines
@@ -1,11 +1,161 @@
 # -*- coding: utf-8 -*-
 """A collection of utility functions"""
 
-from collections import OrderedDict
+import hashlib
+import struct
+import time
+from collections import Counter, OrderedDict, namedtuple
+from datetime import datetime, timedelta
 from itertools import chain
 
 
-def sessionize(log, ts_index, cid_index, timeout):
+_timer = getattr(time, 'perf_counter', time.time)
+
+try:
+    _text_type = unicode
+except NameError:  # pragma: no cover
+    _text_type = str
+
+Window = namedtuple('Window', ['start', 'end', 'rows', 'counts', 'clients'])
+
+
+def sample(log, cid_index, rate, salt=''):
+    """
+    Keeps or drops entire clients by a stable hash of their client id
+
+    Since the decision depends only on the client id, every row of a sampled
+    client is kept, and the same clients are sampled across runs and
+    machines::
+
+        >>> log = [(str(i % 1000), 'event') for i in range(10000)]
+        >>> sampled = list(sample(log, 0, 0.1))
+        >>> len(set(cid for cid, _ in sampled))
+        103
+        >>> len(sampled)
+        1030
+
+    A sample with a lower rate is always a subset of one with a higher rate
+    and the same `salt`. Use different `salt` values to draw independent
+    samples.
+
+    Apply the function before :func:`sessionize` or any other stage so that
+    dropped clients never allocate any state.
+
+    :param log: an iterable containing zero or more tuples
+    :type  log: iterable
+    :param cid_index: index of client id column
+    :type  cid_index: int
+    :param rate: fraction of clients to keep, between 0 and 1
+    :type  rate: float
+    :param salt: a string mixed into the hash
+    :type  salt: str
+
+    :return: generator of rows belonging to sampled clients
+    """
+    if not 0 <= rate <= 1:
+        raise ValueError('rate should be between 0 and 1')
+    threshold = int(rate * 0x100000000)
+
+    for row in log:
+        if _client_hash(row[cid_index], salt) < threshold:
+            yield row
+
+
+def _client_hash(cid, salt):
+    key = _utf8(salt) + b'\0' + _utf8(cid)
+    return struct.unpack('>I', hashlib.md5(key).digest()[:4])[0]
+
+
+def _utf8(value):
+    # Byte strings, such as client ids read as str on Python 2, are hashed
+    # as they are, so that hashes agree across Python versions
+    if isinstance(value, bytes):
+        return value
+    return _text_type(value).encode('utf-8')
+
+
+class Deduplicator(object):
+    """
+    Drops duplicate rows seen within a time horizon
+
+    Collectors with at-least-once delivery may send the same row twice::
+
+        >>> log = [
+        ...     (0, 'alan', 'fail'),
+        ...     (1, 'alan', 'fail'),
+        ...     (0, 'alan', 'fail'),
+        ...     (2, 'alan', 'success'),
+        ... ]
+        >>> dedup = Deduplicator(0, 10)
+        >>> list(dedup.filter(log))
+        [(0, 'alan', 'fail'), (1, 'alan', 'fail'), (2, 'alan', 'success')]
+        >>> dedup.suppressed
+        1
+
+    By default a row is a duplicate of another when every column is equal.
+    Pass `key_indices` to compare only some columns, e.g. an event id.
+
+    Seen keys are kept in two time buckets, each spanning `horizon`. When the
+    stream moves past the current bucket, the older bucket is discarded, so
+    memory is bounded by the number of distinct rows within twice the horizon
+    instead of growing with the stream. A duplicate is guaranteed to be
+    suppressed if it arrives within `horizon` of the first row, and may be
+    suppressed up to twice the horizon.
+
+    The deduplicator keeps its state between calls of :meth:`filter`, so it
+    can be applied to consecutive chunks of the same stream.
+
+    :param ts_index: index of timestamp column
+    :type  ts_index: int
+    :param horizon: how long to remember a row
+    :type  horizon: :class:`~datetime.timedelta`
+    :param key_indices: indices of columns identifying a row. If `None`, the
+                        whole row is compared.
+    :type  key_indices: list
+    """
+    def __init__(self, ts_index, horizon, key_indices=None):
+        self._ts_index = ts_index
+        self._horizon = horizon
+        self._key_indices = key_indices
+        self._bucket_start = None
+        self._current = set()
+        self._previous = set()
+        self.suppressed = 0
+
+    def filter(self, log):
+        """Yields rows in `log` that are not duplicates"""
+        ts_index = self._ts_index
+        horizon = self._horizon
+        key_indices = self._key_indices
+
+        for row in log:
+            cur_ts = row[ts_index]
+
+            # Rotate buckets
+            if self._bucket_start is None:
+                self._bucket_start = cur_ts
+            elif cur_ts - self._bucket_start >= horizon:
+                if cur_ts - self._bucket_start >= horizon + horizon:
+                    self._previous = set()
+                else:
+                    self._previous = self._current
+                self._current = set()
+                self._bucket_start = cur_ts
+
+            if key_indices is None:
+                key = tuple(row)
+            else:
+                key = tuple(row[i] for i in key_indices)
+
+            if key in self._current or key in self._previous:
+                self.suppressed += 1
+                continue
+            self._current.add(key)
+            yield row
+
+
+def sessionize(log, ts_index, cid_index, timeout, sessions=None,
+               metrics=None):
     """
     Groups a log stream into sessions
 
@@ -58,20 +208,41 @@ def sessionize(log, ts_index, cid_index, timeout):
     :type  cid_index: int
     :param timeout: session timeout
     :type  timeout: :class:`~datetime.timedelta`
+    :param sessions: open sessions from a previous call. If given, sessions
+                     still open at the end of `log` are kept in it instead of
+                     being flushed, so that the next call with the rest of the
+                     stream can resume them.
+    :type  sessions: :class:`~collections.OrderedDict`
+    :param metrics: registry to report rows, opened, closed and forced
+                    sessions, open sessions and the time of sweeps expiring
+                    sessions to
+    :type  metrics: :class:`~loganalysis.metrics.Metrics`
 
     :return: generator of tuples composed of (cid, sessions)
     """
-    sessions = OrderedDict()
+    flush = sessions is None
+    if flush:
+        sessions = OrderedDict()
+    instrument = None
+    if metrics is not None:
+        instrument = _SessionizeMetrics(metrics, sessions)
 
     for row in log:
         cur_ts = row[ts_index]
 
         # Yield expired sessions
-        for cid, session in sessions.items():
+        while sessions:
+            cid = next(iter(sessions))
+            session = sessions[cid]
             if not _check_session_timeout(session, cur_ts, timeout):
                 # Since items in sessions are ordered by updated time,
                 # we don't have to look futher
                 break
+            if instrument is not None:
+                for cid, session_log in instrument.expire(sessions, cur_ts,
+                                                          timeout):
+                    yield cid, session_log
+                break
             yield cid, session[1]
             del sessions[cid]
 
@@ -86,16 +257,230 @@ def sessionize(log, ts_index, cid_index, timeout):
         session[0] = cur_ts
         session[1].append(row)
 
+    if instrument is not None:
+        instrument.publish(sessions, flush)
+
+    if not flush:
+        return
+
     # If there are non-empty session logs, flush them.
     for cid, session in sessions.items():
         if len(session[1]) > 0:
             yield cid, session[1]
 
 
+class _SessionizeMetrics(object):
+    # Nothing is done per row: rows and opened sessions are derived from the
+    # sessions closed so far and the ones still open, and only sweeps that
+    # expire at least one session are timed. Counters are updated at most
+    # every `metrics.interval` seconds and at the end of the stream.
+
+    def __init__(self, metrics, sessions):
+        self.metrics = metrics
+        self.closed = 0
+        self.closed_rows = 0
+        self.initial_sessions = len(sessions)
+        self.initial_rows = _count_rows(sessions)
+        self.published = (0, 0, 0)
+        self.last_publish = time.time()
+        self.rows_metric = metrics.counter('sessionize_rows_total')
+        self.opened_metric = metrics.counter(
+            'sessionize_sessions_opened_total'
+        )
+        self.closed_metric = metrics.counter(
+            'sessionize_sessions_closed_total'
+        )
+        self.forced_metric = metrics.counter(
+            'sessionize_sessions_forced_total'
+        )
+        self.open_metric = metrics.gauge('sessionize_open_sessions')
+        self.sweep_metric = metrics.histogram('sessionize_sweep_seconds')
+
+    def expire(self, sessions, cur_ts, timeout):
+        """Removes and returns expired sessions, timing the sweep"""
+        started = _timer()
+        expired = []
+        while sessions:
+            cid = next(iter(sessions))
+            session = sessions[cid]
+            if not _check_session_timeout(session, cur_ts, timeout):
+                break
+            expired.append((cid, session[1]))
+            self.closed_rows += len(session[1])
+            del sessions[cid]
+        self.sweep_metric.observe(_timer() - started)
+
+        self.closed += len(expired)
+        if time.time() - self.last_publish >= self.metrics.interval:
+            self.publish(sessions)
+        return expired
+
+    def publish(self, sessions, flush=False):
+        rows = self.closed_rows + _count_rows(sessions) - self.initial_rows
+        opened = self.closed + len(sessions) - self.initial_sessions
+        published_rows, published_opened, published_closed = self.published
+        self.rows_metric.inc(rows - published_rows)
+        self.opened_metric.inc(opened - published_opened)
+        self.closed_metric.inc(self.closed - published_closed)
+        self.published = (rows, opened, self.closed)
+        self.last_publish = time.time()
+        if flush:
+            self.forced_metric.inc(len(sessions))
+            self.open_metric.set(0)
+        else:
+            self.open_metric.set(len(sessions))
+        self.metrics.maybe_flush()
+
+
+def _count_rows(sessions):
+    return sum(len(session[1]) for session in sessions.values())
+
+
 def _check_session_timeout(session, cur_ts, timeout):
     return session[0] is not None and cur_ts - session[0] >= timeout
 
 
+def window(log, ts_index, size, slide=None, key_index=None, cid_index=None,
+           origin=None):
+    """
+    Aggregates a log stream over tumbling or sliding event-time windows
+
+    Using the same log as :func:`sessionize`::
+
+        >>> from datetime import datetime, timedelta
+        >>> log = [
+        ...     (datetime(2015, 1, 1, 0, 10, 0), 'alan', 'login'),
+        ...     (datetime(2015, 1, 1, 0, 11, 0), 'alan', 'stage/1'),
+        ...     (datetime(2015, 1, 1, 0, 11, 0), 'brad', 'stage/1'),
+        ...     (datetime(2015, 1, 1, 0, 12, 0), 'alan', 'stage/2'),
+        ...     (datetime(2015, 1, 1, 0, 13, 0), 'brad', 'stage/2'),
+        ...     (datetime(2015, 1, 1, 0, 17, 0), 'alan', 'stage/3'),
+        ...     (datetime(2015, 1, 1, 0, 18, 0), 'alan', 'stage/4'),
+        ...     (datetime(2015, 1, 1, 0, 19, 0), 'brad', 'stage/3'),
+        ... ]
+
+    The function yields 5-minute tumbling windows, each as soon as a row at or
+    after the end of the window arrives::
+
+        >>> windows = list(window(
+        ...     log, 0, timedelta(minutes=5), key_index=2, cid_index=1
+        ... ))
+        >>> [(w.start.minute, w.rows, w.clients) for w in windows]
+        [(10, 5, 2), (15, 3, 2)]
+        >>> windows[0].counts['stage/1']
+        2
+
+    Passing `slide` yields overlapping windows instead. A row belongs to every
+    window covering its timestamp::
+
+        >>> windows = window(
+        ...     log, 0, timedelta(minutes=5), slide=timedelta(minutes=1)
+        ... )
+        >>> [(w.start.minute, w.rows) for w in windows][:3]
+        [(6, 1), (7, 3), (8, 4)]
+
+    Each window is a :class:`Window` tuple of (start, end, number of rows,
+    :class:`~collections.Counter` of `key_index` column, number of distinct
+    clients). Windows without any row are not yielded. Window boundaries are
+    aligned to `origin`, which defaults to the Unix epoch for
+    :class:`~datetime.datetime` timestamps and to zero for numbers.
+
+    Like :func:`sessionize`, the log is expected to be ordered by timestamp.
+    Rows arriving after their windows have been yielded are ignored. At most
+    ``size / slide`` windows are open at once. With `cid_index`, each open
+    window keeps the ids of its distinct clients, so memory also grows with
+    the number of clients active within `size`.
+
+    :param log: an iterable containing zero or more tuples
+    :type  log: iterable
+    :param ts_index: index of timestamp column
+    :type  ts_index: int
+    :param size: window size
+    :type  size: :class:`~datetime.timedelta`
+    :param slide: interval between window starts. Defaults to `size`, which
+                  makes tumbling windows.
+    :type  slide: :class:`~datetime.timedelta`
+    :param key_index: index of column to count rows by
+    :type  key_index: int
+    :param cid_index: index of client id column to count distinct clients by
+    :type  cid_index: int
+    :param origin: timestamp that window boundaries are aligned to
+
+    :return: generator of :class:`Window` tuples
+    """
+    if slide is None:
+        slide = size
+    if not size > size * 0 or not slide > slide * 0:
+        raise ValueError('size and slide should be positive')
+
+    # start -> [rows, counts, clients], ordered by start
+    windows = OrderedDict()
+    last_closed = None
+
+    for row in log:
+        cur_ts = row[ts_index]
+        if origin is None:
+            origin = _default_origin(cur_ts)
+
+        # Yield closed windows
+        while windows:
+            start = next(iter(windows))
+            if cur_ts < start + size:
+                break
+            yield _close_window(start, size, windows.pop(start))
+            last_closed = start
+
+        # Update every window covering the row, from the oldest one
+        latest = origin + _n_slides(cur_ts - origin, slide) * slide
+        starts = []
+        start = latest
+        while start + size > cur_ts:
+            if last_closed is not None and start <= last_closed:
+                break
+            starts.append(start)
+            start -= slide
+
+        key = row[key_index] if key_index is not None else None
+        cid = row[cid_index] if cid_index is not None else None
+        for start in reversed(starts):
+            aggregate = windows.get(start)
+            if aggregate is None:
+                aggregate = [0, Counter(), set()]
+                windows[start] = aggregate
+            aggregate[0] += 1
+            if key_index is not None:
+                aggregate[1][key] += 1
+            if cid_index is not None:
+                aggregate[2].add(cid)
+
+    # Flush remaining windows
+    for start, aggregate in windows.items():
+        yield _close_window(start, size, aggregate)
+
+
+def _default_origin(ts):
+    if isinstance(ts, datetime):
+        return datetime(1970, 1, 1, tzinfo=ts.tzinfo)
+    return ts - ts
+
+
+def _n_slides(elapsed, slide):
+    # timedelta // timedelta isn't supported on Python 2, so timedeltas are
+    # divided as integer microseconds
+    if isinstance(elapsed, timedelta):
+        return _microseconds(elapsed) // _microseconds(slide)
+    return int(elapsed // slide)
+
+
+def _microseconds(td):
+    return (td.days * 86400 + td.seconds) * 1000000 + td.microseconds
+
+
+def _close_window(start, size, aggregate):
+    rows, counts, clients = aggregate
+    return Window(start, start + size, rows, counts, len(clients))
+
+
 def fsm(events, init_state, table):
     """
     Simple finite state machine.
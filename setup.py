@@ -36,6 +36,11 @@ setup(
     package_dir={'loganalysis':
                  'loganalysis'},
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'loganalysis = loganalysis.cli:main',
+        ],
+    },
     setup_requires=['nose>=1.0'],
     install_requires=requirements,
     license="BSD",
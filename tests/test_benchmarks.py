@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from benchmarks import run, workload
+from loganalysis import utils
+
+
+class WorkloadTest(unittest.TestCase):
+    def test_reproducible(self):
+        self.assertListEqual(
+            workload.generate(50, seed=1), workload.generate(50, seed=1)
+        )
+        self.assertNotEqual(
+            workload.generate(50, seed=1), workload.generate(50, seed=2)
+        )
+
+    def test_shape(self):
+        log = workload.generate(20, mean_session_length=5,
+                                distribution='fixed', n_columns=5,
+                                sessions_per_client=2)
+        self.assertEqual(20 * 5 * 2, len(log))
+        self.assertTrue(all(len(row) == 5 for row in log))
+        self.assertTrue(isinstance(log[0][0], datetime))
+        self.assertListEqual(sorted(log), log)
+
+        sessions = list(utils.sessionize(log, 0, 1, timedelta(minutes=30)))
+        self.assertEqual(40, len(sessions))
+
+    def test_epoch(self):
+        log = workload.generate(5, ts_type='epoch')
+        self.assertTrue(isinstance(log[0][0], float))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, workload.generate, 5, n_columns=2)
+        self.assertRaises(ValueError, workload.generate, 5,
+                          distribution='zipf')
+
+
+class RunTest(unittest.TestCase):
+    def test_run_every_benchmark(self):
+        results = run.run(sorted(run.BENCHMARKS), [10], repeat=1)
+        self.assertEqual(len(run.BENCHMARKS), len(results))
+        for result in results.values():
+            self.assertGreater(result['rows_per_sec'], 0)
+
+    def test_run_every_benchmark_over_epoch(self):
+        results = run.run(sorted(run.BENCHMARKS), [10], repeat=1,
+                          ts_type='epoch')
+        self.assertEqual(len(run.BENCHMARKS), len(results))
+
+    def test_compare(self):
+        baseline = {
+            'a/10': {'rows_per_sec': 100.0},
+            'b/10': {'rows_per_sec': 100.0},
+        }
+        results = {
+            'a/10': {'rows_per_sec': 90.0},
+            'b/10': {'rows_per_sec': 70.0},
+            'c/10': {'rows_per_sec': 1.0},
+        }
+        self.assertListEqual(
+            [('b/10', 100.0, 70.0)], run.compare(results, baseline, 0.2)
+        )
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.stdout = sys.stdout
+        sys.stdout = io.StringIO() if sys.version_info[0] >= 3 \
+            else io.BytesIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.remove(self.path)
+
+    def test_save_and_compare(self):
+        argv = ['sample', '--sizes', '10', '--repeat', '1']
+        self.assertEqual(0, run.main(argv + ['--save', self.path]))
+        with open(self.path) as f:
+            saved = json.load(f)
+        self.assertEqual('datetime', saved['workload']['ts_type'])
+        self.assertListEqual(['sample/10'], list(saved['results']))
+
+        # A huge threshold never reports a regression
+        self.assertEqual(0, run.main(
+            argv + ['--compare', self.path, '--threshold', '1']
+        ))
+
+    def test_refuse_different_workload(self):
+        argv = ['sample', '--sizes', '10', '--repeat', '1']
+        run.main(argv + ['--save', self.path])
+        stderr = sys.stderr
+        sys.stderr = sys.stdout
+        try:
+            with self.assertRaises(SystemExit):
+                run.main(argv + ['--ts-type', 'epoch',
+                                 '--compare', self.path])
+        finally:
+            sys.stderr = stderr
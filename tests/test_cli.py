@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from loganalysis import cli
+
+
+class CommandLineTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            u'0\talan\tlogin\n',
+            u'1\talan\tdosomething\n',
+            u'2\talan\tacquired\tlegend\n',
+            u'3\tbrad\tlogin\n',
+            u'4\tbrad\tacquired\trare\n',
+            u'5\tcate\tlogin\n',
+            u'6\tbrad\tlogout\n',
+            u'7\tcate\tacquired\tunique\n',
+            u'8\tcate\tlogout\n',
+            u'9\tcate\tlogin\n',
+        ]
+
+    def run_cli(self, *argv):
+        args = cli._parser().parse_args(
+            ['--ts-format', 'epoch', '--timeout', '10'] + list(argv)
+        )
+        output = []
+        cli.run(args, iter(self.lines), output.append)
+        return u''.join(output).splitlines()
+
+    def test_sessions(self):
+        actual = self.run_cli()
+        self.assertEqual(10, len(actual))
+        self.assertEqual(
+            u'alan\t0\t1970-01-01T00:00:00.000000\talan\tlogin', actual[0]
+        )
+
+    def test_match(self):
+        pattern = (
+            r'[[ {{2:login}} ]][[ ]]*?'
+            r'[[ {{2:acquired}} {{3:(legend|unique)}} ]]'
+        )
+        actual = self.run_cli('--match', pattern, '--format', 'json')
+        records = [json.loads(line) for line in actual]
+        self.assertListEqual(
+            [u'alan', u'cate'], [record['cid'] for record in records]
+        )
+        self.assertEqual(3, len(records[0]['match']))
+        self.assertEqual(
+            [u'1970-01-01T00:00:07.000000', u'cate', u'acquired', u'unique'],
+            records[1]['match'][-1]
+        )
+
+    def test_filter_and_sample(self):
+        actual = self.run_cli('--filter', r'{{2:login}}',
+                              '--sample-rate', '1')
+        self.assertEqual(4, len(actual))
+        self.assertListEqual([], self.run_cli('--sample-rate', '0'))
+
+    def test_fsm(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'table.json')
+            with open(path, 'w') as f:
+                json.dump([
+                    ['init', 'login', None, 'logged-in'],
+                    ['logged-in', 'logout', 'good-bye', 'init'],
+                    ['logged-in', None, 'timeout', 'init'],
+                ], f)
+            actual = self.run_cli('--fsm', path)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertListEqual(
+            [u'alan\t0\ttimeout', u'brad\t1\tgood-bye',
+             u'cate\t2\tgood-bye', u'cate\t3\ttimeout'],
+            actual
+        )
+
+    def test_parallel(self):
+        pattern = r'[[ {{2:login}} ]][[ ]]*?[[ {{2:logout}} ]]'
+        sequential = self.run_cli('--match', pattern)
+        parallel = self.run_cli('--match', pattern, '--workers', '2',
+                                '--batch-size', '1')
+        self.assertEqual(6, len(sequential))
+        self.assertListEqual(sequential, parallel)
+
+    def test_metrics_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'loganalysis.prom')
+            self.run_cli('--metrics-file', path)
+            with open(path) as f:
+                self.assertIn('sessionize_rows_total 10\n', f.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_main_with_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'app.log')
+            with open(path, 'w') as f:
+                f.write(u''.join(self.lines))
+            self.assertEqual(0, cli.main(['--ts-format', 'epoch', path]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class _Stdout(object):
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.data = u'0\talan\tlogin\n1\talan\t\xe9v\xe9nement\n'
+        self.stdin = sys.stdin
+        self.stdout = sys.stdout
+        sys.stdout = _Stdout()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        sys.stdin = self.stdin
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tmpdir)
+
+    def main(self, encoding):
+        self.assertEqual(0, cli.main(['--ts-format', 'epoch',
+                                      '--encoding', encoding]))
+        return sys.stdout.buffer.getvalue().decode(encoding).splitlines()
+
+    def test_stdin_file(self):
+        # A file object with a descriptor, like sys.stdin of Python 2
+        path = os.path.join(self.tmpdir, 'app.log')
+        with io.open(path, 'wb') as f:
+            f.write(self.data.encode('latin-1'))
+        with io.open(path, 'rb') as f:
+            sys.stdin = f
+            actual = self.main('latin-1')
+        self.assertEqual(2, len(actual))
+        self.assertTrue(actual[1].endswith(u'\t\xe9v\xe9nement'))
+
+    def test_stdin_text(self):
+        # A text stream over a buffer, like sys.stdin of Python 3
+        sys.stdin = io.TextIOWrapper(io.BytesIO(self.data.encode('utf-8')))
+        actual = self.main('utf-8')
+        self.assertTrue(actual[1].endswith(u'\t\xe9v\xe9nement'))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from loganalysis import utils
+from loganalysis.follow import Tail
+
+
+class TailTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'app.log')
+        self.state_path = os.path.join(self.tmpdir, 'app.log.state')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def append(self, text, path=None):
+        with open(path or self.path, 'ab') as f:
+            f.write(text.encode('utf-8'))
+
+    def read(self):
+        tail = Tail([self.path], self.state_path)
+        try:
+            return list(tail.lines())
+        finally:
+            tail.save()
+            tail.close()
+
+    def test_resume_from_saved_offset(self):
+        self.append(u'a\nb\n')
+        self.assertListEqual([u'a', u'b'], self.read())
+        self.append(u'c\n')
+        self.assertListEqual([u'c'], self.read())
+        self.assertListEqual([], self.read())
+
+    def test_incomplete_line(self):
+        self.append(u'a\nb')
+        self.assertListEqual([u'a'], self.read())
+        self.append(u'c\n')
+        self.assertListEqual([u'bc'], self.read())
+
+    def test_truncation(self):
+        self.append(u'a\nb\n')
+        self.read()
+        with open(self.path, 'wb') as f:
+            f.write(b'c\n')
+        self.assertListEqual([u'c'], self.read())
+
+    def test_rotation(self):
+        tail = Tail([self.path])
+        self.append(u'a\n')
+        self.assertListEqual([u'a'], list(tail.lines()))
+
+        # Lines written right before rotation should not be lost
+        self.append(u'b\n')
+        os.rename(self.path, self.path + '.1')
+        self.append(u'c\n')
+        self.assertListEqual([u'b', u'c'], list(tail.lines()))
+        tail.close()
+
+    def test_rotation_between_runs(self):
+        self.append(u'a\n')
+        self.read()
+        os.rename(self.path, self.path + '.1')
+        self.append(u'b\n')
+        self.assertListEqual([u'b'], self.read())
+
+    def test_resumable_sessionize(self):
+        def run():
+            tail = Tail([self.path], self.state_path)
+            sessions = tail.state.setdefault('sessions', OrderedDict())
+            rows = (tuple(line.split(u'\t')) for line in tail.lines())
+            rows = ((int(ts), cid, event) for ts, cid, event in rows)
+            result = list(utils.sessionize(rows, 0, 1, 5, sessions))
+            tail.save()
+            tail.close()
+            return result
+
+        self.append(u'0\talan\tlogin\n1\tbrad\tlogin\n')
+        self.assertListEqual([], run())
+
+        self.append(u'3\talan\tlogout\n9\tbrad\tlogout\n')
+        self.assertListEqual(
+            [
+                (u'alan', [(0, u'alan', u'login'), (3, u'alan', u'logout')]),
+                (u'brad', [(1, u'brad', u'login')]),
+            ],
+            run()
+        )
+        self.assertListEqual([], run())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import unittest
+from datetime import datetime, timedelta
+
+from loganalysis import utils
+from loganalysis.funnel import Funnel
+
+
+class FunnelTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2014, 1, 1, 0, 0, 0)
+        self.funnel = Funnel(
+            [r'{{2:login}}', r'{{2:acquired}} {{3:(legend|unique)}}',
+             r'{{2:logout}}'],
+            ts_index=0,
+        )
+
+    def test_progress(self):
+        session = [
+            (self.now + timedelta(0), 'alan', 'acquired', 'legend'),
+            (self.now + timedelta(1), 'alan', 'login'),
+            (self.now + timedelta(2), 'alan', 'acquired', 'rare'),
+            (self.now + timedelta(4), 'alan', 'acquired', 'unique'),
+            (self.now + timedelta(5), 'alan', 'logout'),
+        ]
+        reached, elapsed = self.funnel.progress(session)
+        self.assertEqual(3, reached)
+        self.assertListEqual([timedelta(3), timedelta(1)], elapsed)
+
+    def test_progress_without_timestamp(self):
+        funnel = Funnel([r'{{2:login}}', r'{{2:logout}}'])
+        session = [
+            (self.now + timedelta(0), 'alan', 'login'),
+            (self.now + timedelta(1), 'alan', 'logout'),
+        ]
+        self.assertEqual((2, []), funnel.progress(session))
+
+    def test_empty_steps(self):
+        self.assertRaises(ValueError, Funnel, [])
+
+    def test_count_with_sessionization(self):
+        log = [
+            (self.now + timedelta(0), 'alan', 'login'),
+            (self.now + timedelta(1), 'alan', 'acquired', 'legend'),
+            (self.now + timedelta(2), 'alan', 'logout'),
+            (self.now + timedelta(3), 'brad', 'login'),
+            (self.now + timedelta(4), 'brad', 'acquired', 'rare'),
+            (self.now + timedelta(5), 'cate', 'login'),
+            (self.now + timedelta(6), 'brad', 'logout'),
+            (self.now + timedelta(7), 'cate', 'acquired', 'unique'),
+            (self.now + timedelta(8), 'dave', 'logout'),
+        ]
+        sessions = utils.sessionize(log, 0, 1, timedelta(10))
+        actual = self.funnel.count(session for cid, session in sessions)
+        self.assertListEqual([4, 3, 2, 1], actual)
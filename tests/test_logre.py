@@ -2,9 +2,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 
+import json
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
 from datetime import datetime, timedelta
 
+import loganalysis
 from loganalysis import utils
 from loganalysis import logre
 
@@ -26,6 +32,25 @@ class TupleRegexTest(unittest.TestCase):
             actual
         )
 
+    def test_encode_numbers(self):
+        self.assertEqual(
+            '1420070400.123456\t3\tfail',
+            logre.encode_tuple([1420070400.123456, 3, 'fail'])
+        )
+        self.assertEqual(
+            u'12345678901234567890\tfail\t\xe9',
+            logre.encode_tuple([12345678901234567890, 'fail', u'\xe9'])
+        )
+
+    def test_encode_bool(self):
+        # bool is no integer column, so it is left alone like before
+        self.assertRaises(TypeError, logre.encode_tuple, [True, 'fail'])
+
+    def test_match_row(self):
+        p = logre.TupleRegex(r'{{1:success}} {{2:a}}')
+        self.assertTrue(p.match((self.now, 'success', 'a', 'blah')))
+        self.assertFalse(p.match((self.now, 'successful', 'a')))
+
     def test_match(self):
         log = [
             (self.now + timedelta(0), 'fail', 'a'),
@@ -163,3 +188,344 @@ class LogRegexTest(unittest.TestCase):
         ]
         actual = list(p.finditer_m(session for user, session in sessions))
         self.assertEqual(expected, actual)
+
+
+class PatternCacheTest(unittest.TestCase):
+    def setUp(self):
+        logre.purge()
+        self.pattern = r'[[ {{1:fail}} ]]{2,}[[ {{1:success}} ]]'
+
+    def tearDown(self):
+        logre.purge()
+
+    def test_cached(self):
+        self.assertIs(
+            logre.LogRegex(self.pattern)._compiled_p,
+            logre.LogRegex(self.pattern)._compiled_p,
+        )
+        self.assertIsNot(
+            logre.LogRegex(self.pattern)._compiled_p,
+            logre.LogRegex(self.pattern, ',')._compiled_p,
+        )
+
+        # Row groups are only compiled in for matches()
+        p = logre.LogRegex(self.pattern)
+        self.assertNotIn('_row0', p._compiled_p.groupindex)
+        next(p.matches([(datetime(2014, 1, 1), 'success')]), None)
+        self.assertIn('_row0', p._grouped_p.groupindex)
+
+        # The same string is translated differently by TupleRegex
+        self.assertIsNot(
+            logre.LogRegex(r'{{1:fail}}')._compiled_p,
+            logre.TupleRegex(r'{{1:fail}}')._compiled_p,
+        )
+
+    def test_lru(self):
+        max_size = logre._CACHE_MAX
+        logre._CACHE_MAX = 2
+        try:
+            first = logre.TupleRegex(r'{{1:a}}')._compiled_p
+            logre.TupleRegex(r'{{1:b}}')
+            logre.TupleRegex(r'{{1:a}}')
+            logre.TupleRegex(r'{{1:c}}')
+
+            # "b" was the least recently used one
+            self.assertIs(first, logre.TupleRegex(r'{{1:a}}')._compiled_p)
+            self.assertListEqual(
+                [('tuple', r'{{1:c}}', '\t'), ('tuple', r'{{1:a}}', '\t')],
+                list(logre._cache)
+            )
+        finally:
+            logre._CACHE_MAX = max_size
+
+    def test_pickle(self):
+        now = datetime(2014, 1, 1, 0, 0, 0)
+        log = [
+            (now + timedelta(0), 'fail'),
+            (now + timedelta(1), 'fail'),
+            (now + timedelta(2), 'success'),
+        ]
+        for p in [logre.LogRegex(self.pattern),
+                  logre.TupleRegex(r'{{1:success}}')]:
+            data = pickle.dumps(p, pickle.HIGHEST_PROTOCOL)
+            self.assertLess(len(data), 200)
+            unpickled = pickle.loads(data)
+            self.assertEqual(p.pattern, unpickled.pattern)
+            self.assertListEqual(list(p.finditer(log)),
+                                 list(unpickled.finditer(log)))
+
+    def test_disk_cache(self):
+        logre.LogRegex(self.pattern)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'patterns.json')
+            logre.save_pattern_cache(path)
+            logre.purge()
+            logre.load_pattern_cache(path)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        key = ('log', self.pattern, '\t')
+        self.assertEqual(
+            logre.compile_pattern(self.pattern),
+            logre._translations[key]
+        )
+
+    def test_stale_disk_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'patterns.json')
+            stale = [['log', self.pattern, '\t', 'stale']]
+            for saved in [
+                stale,
+                {'version': '0.0.1', 'format': logre._TRANSLATION_FORMAT,
+                 'patterns': stale},
+                {'version': loganalysis.__version__, 'format': 1,
+                 'patterns': stale},
+            ]:
+                with open(path, 'w') as f:
+                    json.dump(saved, f)
+                self.assertEqual(0, logre.load_pattern_cache(path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertDictEqual({}, logre._translations)
+        m = next(logre.LogRegex(self.pattern).matches([
+            (datetime(2014, 1, 1), 'fail'),
+            (datetime(2014, 1, 1), 'fail'),
+            (datetime(2014, 1, 1), 'success'),
+        ]))
+        self.assertListEqual([(0, 2), (2, 3)], m.spans)
+
+
+class LogMatchTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2014, 1, 1, 0, 0, 0)
+        self.log = [
+            (self.now + timedelta(0), 'cate', 'login'),
+            (self.now + timedelta(1), 'cate', 'dosomething'),
+            (self.now + timedelta(2), 'cate', 'dosomething'),
+            (self.now + timedelta(3), 'cate', 'acquired', 'unique'),
+            (self.now + timedelta(4), 'cate', 'dosomething'),
+            (self.now + timedelta(5), 'cate', 'login'),
+            (self.now + timedelta(6), 'cate', 'acquired', 'legend'),
+            (self.now + timedelta(7), 'cate', 'logout'),
+        ]
+        self.pattern = (
+            r'[[ {{2:login}} ]]'
+            r'[[ ]]*?'
+            r'[[ {{2:acquired}} {{3:(?P<item>legend|unique)}} ]]'
+            r'[[ ]]*?'
+            r'[[ {{2:logout}} ]]?'
+        )
+
+    def test_matches(self):
+        p = logre.LogRegex(self.pattern)
+        matches = list(p.matches(self.log))
+        self.assertEqual(2, len(matches))
+
+        first, second = matches
+        self.assertEqual((0, 4), (first.start, first.end))
+        self.assertListEqual([0, 1, 2, 3], first.indices)
+        self.assertEqual(tuple(self.log[0:4]), first.rows)
+        self.assertListEqual(
+            [(0, 1), (1, 3), (3, 4), (4, 4), (4, 4)], first.spans
+        )
+        self.assertDictEqual({'item': 'unique'}, first.captures)
+
+        self.assertEqual((5, 8), (second.start, second.end))
+        self.assertListEqual(
+            [(5, 6), (6, 6), (6, 7), (7, 7), (7, 8)], second.spans
+        )
+        self.assertEqual('legend', second.group('item'))
+
+    def test_same_rows_as_finditer_m(self):
+        p = logre.LogRegex(self.pattern)
+        self.assertListEqual(
+            list(p.finditer_m([self.log, self.log[:4]])),
+            [m.rows for m in p.matches_m([self.log, self.log[:4]])]
+        )
+
+    def test_repeated_row_group(self):
+        log = [
+            (self.now + timedelta(0), 'fail', 'a'),
+            (self.now + timedelta(1), 'fail', 'b'),
+            (self.now + timedelta(2), 'fail', 'c'),
+            (self.now + timedelta(3), 'success', 'd'),
+        ]
+        p = logre.LogRegex(
+            r'[[ {{1:fail}} {{2:(?P<last>.)}} ]]{2,}[[ {{1:success}} ]]'
+        )
+        m = next(p.matches(log))
+        self.assertListEqual([(0, 3), (3, 4)], m.spans)
+        self.assertEqual('c', m.group('last'))
+
+    def test_alternation_outside_row_groups(self):
+        p = r'[[ {{1:a}} ]]|[[ {{1:b}} ]]'
+        self.assertEqual(
+            r'(?P<_row0>(^\d+\t.*?\ta(\t.+)?\n))|'
+            r'(?P<_row1>(^\d+\t.*?\tb(\t.+)?\n))',
+            logre.compile_pattern(p, groups=True)
+        )
+
+    def test_col_sep(self):
+        log = [('0', 'fail'), ('1', 'success')]
+        p = logre.LogRegex(r'[[ {{1:fail}} ]][[ {{1:success}} ]]', ',')
+        self.assertListEqual([tuple(log)], list(p.finditer(log)))
+
+    def test_col_sep_extra_columns(self):
+        log = [('alan', 'login', 'x'), ('alan', 'logout', 'y', 'z')]
+        p = logre.LogRegex(r'[[ {{1:login}} ]][[ {{1:logout}} ]]', ',')
+        self.assertListEqual([tuple(log)], list(p.finditer(log)))
+
+        # A tab inside a column is no column separator
+        log = [('alan', 'login\tx')]
+        p = logre.LogRegex(r'[[ {{1:login}} ]]', ',')
+        self.assertListEqual([], list(p.finditer(log)))
+
+
+class StreamingLogRegexTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2014, 1, 1, 0, 0, 0)
+        self.window = timedelta(minutes=5)
+        self.pattern = r'[[ {{2:fail}} ]]{3}[[ {{2:success}} ]]'
+
+    def at(self, minutes, cid, event):
+        return (self.now + timedelta(minutes=minutes), cid, event)
+
+    def matcher(self, pattern=None):
+        return logre.StreamingLogRegex(pattern or self.pattern, 0, 1,
+                                       self.window)
+
+    def test_interleaved_clients(self):
+        log = [
+            self.at(0, 'alan', 'fail'),
+            self.at(0, 'brad', 'fail'),
+            self.at(1, 'alan', 'fail'),
+            self.at(1, 'brad', 'fail'),
+            self.at(2, 'alan', 'fail'),
+            self.at(2, 'brad', 'success'),
+            self.at(3, 'alan', 'success'),
+        ]
+        actual = [(cid, m.rows) for cid, m in self.matcher().finditer(log)]
+        self.assertListEqual(
+            [('alan', (log[0], log[2], log[4], log[6]))], actual
+        )
+
+    def test_emit_as_soon_as_completed(self):
+        p = self.matcher()
+        self.assertListEqual([], p.feed(self.at(0, 'alan', 'fail')))
+        self.assertListEqual([], p.feed(self.at(1, 'alan', 'fail')))
+        self.assertListEqual([], p.feed(self.at(2, 'alan', 'fail')))
+        completed = p.feed(self.at(3, 'alan', 'success'))
+        self.assertEqual(1, len(completed))
+
+        # Matched rows are no longer in flight
+        self.assertEqual(0, len(p))
+
+    def test_same_matches_as_log_regex(self):
+        events = ['fail', 'fail', 'fail', 'fail', 'success', 'fail',
+                  'success', 'fail', 'fail', 'fail', 'success']
+        log = [self.at(0, 'alan', e) for e in events]
+        self.assertListEqual(
+            list(logre.LogRegex(self.pattern).finditer(log)),
+            [m.rows for _, m in self.matcher().finditer(log)]
+        )
+
+    def test_window(self):
+        log = [
+            self.at(0, 'alan', 'fail'),
+            self.at(1, 'alan', 'fail'),
+            self.at(2, 'alan', 'fail'),
+            self.at(5, 'alan', 'fail'),
+            # Too late for the first fail
+            self.at(6, 'alan', 'success'),
+        ]
+        actual = [m.rows for _, m in self.matcher().finditer(log)]
+        self.assertListEqual([tuple(log[1:])], actual)
+
+    def test_expire_clients(self):
+        p = self.matcher()
+        for i in range(100):
+            p.feed(self.at(i, 'user/%d' % i, 'fail'))
+        # Only clients seen within the last 5 minutes are kept
+        self.assertEqual(6, len(p))
+
+        # A client coming back after the window starts over
+        p.feed(self.at(200, 'user/0', 'fail'))
+        self.assertEqual(1, len(p))
+
+    def test_captures(self):
+        p = self.matcher(
+            r'[[ {{2:fail}} ]][[ {{2:(?P<result>success|error)}} ]]'
+        )
+        log = [self.at(0, 'alan', 'fail'), self.at(1, 'alan', 'error')]
+        cid, m = next(p.finditer(log))
+        self.assertEqual('alan', cid)
+        self.assertDictEqual({'result': 'error'}, m.captures)
+
+    def test_non_matching_rows_are_not_kept(self):
+        p = self.matcher()
+        for i in range(4000):
+            self.assertListEqual([], p.feed(self.at(i / 1000, 'alan',
+                                                    'login')))
+            self.assertEqual(0, p.n_rows)
+        self.assertEqual(0, len(p))
+
+    def test_rows_in_flight_are_bounded_by_window(self):
+        p = self.matcher(r'[[ {{2:fail}} ]]{2,}?[[ {{2:success}} ]]')
+        for i in range(100):
+            p.feed(self.at(i, 'alan', 'fail'))
+            self.assertLessEqual(p.n_rows, 6)
+
+        # The match starts at the earliest fail within the window
+        cid, m = p.feed(self.at(100, 'alan', 'success'))[0]
+        self.assertListEqual([self.at(95 + i, 'alan', 'fail')
+                              for i in range(5)], list(m.rows[:-1]))
+
+    def test_optional_row_groups(self):
+        p = self.matcher(r'[[ {{2:fail}} ]]*?[[ {{2:success}} ]]')
+        log = [self.at(0, 'alan', 'success'), self.at(1, 'alan', 'fail'),
+               self.at(2, 'alan', 'success')]
+        self.assertListEqual(
+            [(log[0],), (log[1], log[2])],
+            [m.rows for _, m in p.finditer(log)]
+        )
+
+    def test_spans(self):
+        p = self.matcher(r'[[ {{2:login}} ]][[ ]]*?[[ {{2:buy}} ]]')
+        log = [self.at(0, 'alan', 'login'), self.at(1, 'alan', 'shop'),
+               self.at(2, 'alan', 'shop'), self.at(3, 'alan', 'buy')]
+        _, m = next(p.finditer(log))
+        self.assertListEqual([(0, 1), (1, 3), (3, 4)], m.spans)
+
+    def test_unsupported_pattern(self):
+        for pattern in [r'[[ {{2:a}} ]]([[ {{2:b}} ]])+',
+                        r'[[ {{2:a}} ]] [[ {{2:b}} ]]',
+                        r'{{2:a}}']:
+            self.assertRaises(ValueError, self.matcher, pattern)
+
+    def test_greedy_row_groups(self):
+        # Greedy row groups before the last one would match more rows with
+        # LogRegex than a match reported on completion can
+        for pattern in [r'[[ {{2:login}} ]][[ ]]*[[ {{2:buy}} ]]',
+                        r'[[ {{2:login}} ]][[ {{2:buy}} ]]?'
+                        r'[[ {{2:(buy|logout)}} ]]',
+                        r'[[ {{2:fail}} ]]{2,3}[[ {{2:success}} ]]']:
+            self.assertRaises(ValueError, self.matcher, pattern)
+
+        # Lazy ones match what LogRegex matches
+        log = [self.at(0, 'alan', 'login'), self.at(1, 'alan', 'buy'),
+               self.at(2, 'alan', 'buy')]
+        for pattern in [r'[[ {{2:login}} ]][[ ]]*?[[ {{2:buy}} ]]',
+                        r'[[ {{2:login}} ]][[ {{2:buy}} ]]??'
+                        r'[[ {{2:(buy|logout)}} ]]']:
+            self.assertListEqual(
+                list(logre.LogRegex(pattern).finditer(log)),
+                [m.rows for _, m in self.matcher(pattern).finditer(log)]
+            )
+
+        # The last row group matches as few rows as possible, even if greedy
+        p = self.matcher(r'[[ {{2:login}} ]][[ {{2:buy}} ]]+')
+        self.assertListEqual([tuple(log[:2])],
+                             [m.rows for _, m in p.finditer(log)])
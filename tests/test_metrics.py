@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from loganalysis import logre, utils
+from loganalysis.metrics import LogSink, Metrics, PrometheusFileSink
+
+
+class MetricsTest(unittest.TestCase):
+    def test_same_metric(self):
+        metrics = Metrics()
+        self.assertIs(metrics.counter('a', x='1'), metrics.counter('a', x='1'))
+        self.assertIsNot(metrics.counter('a', x='1'),
+                         metrics.counter('a', x='2'))
+        self.assertRaises(ValueError, metrics.gauge, 'a', x='1')
+
+    def test_histogram(self):
+        metrics = Metrics()
+        histogram = metrics.histogram('t', buckets=(1, 10))
+        for value in [0.5, 1, 5, 50]:
+            histogram.observe(value)
+        self.assertEqual(
+            '# TYPE t histogram\n'
+            't_bucket{le="1"} 2\n'
+            't_bucket{le="10"} 3\n'
+            't_bucket{le="+Inf"} 4\n'
+            't_count 4\n'
+            't_sum 56.5\n',
+            metrics.render()
+        )
+
+    def test_label_escaping(self):
+        metrics = Metrics()
+        metrics.counter('c', pattern='"a"\\b').inc()
+        self.assertIn('c{pattern="\\"a\\"\\\\b"} 1', metrics.render())
+
+    def test_sinks(self):
+        flushed = []
+        metrics = Metrics([flushed.append], interval=3600)
+        metrics.maybe_flush()
+        self.assertListEqual([], flushed)
+        metrics.flush()
+        self.assertListEqual([metrics], flushed)
+
+        metrics.interval = 0
+        metrics.maybe_flush()
+        self.assertEqual(2, len(flushed))
+
+    def test_log_sink(self):
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        logger = logging.getLogger('loganalysis.test_metrics')
+        logger.addHandler(Handler())
+        logger.setLevel(logging.INFO)
+        metrics = Metrics([LogSink(logger)])
+        metrics.counter('rows_total').inc(3)
+        metrics.histogram('t').observe(2)
+        metrics.flush()
+        self.assertListEqual(['metrics rows_total=3 t=1/2'], records)
+
+    def test_prometheus_file_sink(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'loganalysis.prom')
+            metrics = Metrics([PrometheusFileSink(path)])
+            metrics.gauge('open_sessions').set(2)
+            metrics.flush()
+            with open(path) as f:
+                self.assertEqual(metrics.render(), f.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2014, 1, 1, 0, 0, 0)
+        self.log = [
+            (self.now + timedelta(0), 'alan', 'fail'),
+            (self.now + timedelta(1), 'brad', 'fail'),
+            (self.now + timedelta(2), 'alan', 'fail'),
+            (self.now + timedelta(3), 'alan', 'success'),
+            (self.now + timedelta(8), 'brad', 'success'),
+            (self.now + timedelta(9), 'cate', 'fail'),
+        ]
+
+    def value(self, metrics, name, **labels):
+        return metrics.counter(name, **labels).value
+
+    def test_sessionize(self):
+        metrics = Metrics()
+        expected = list(utils.sessionize(self.log, 0, 1, timedelta(5)))
+        actual = list(utils.sessionize(self.log, 0, 1, timedelta(5),
+                                       metrics=metrics))
+        self.assertListEqual(expected, actual)
+
+        self.assertEqual(6, self.value(metrics, 'sessionize_rows_total'))
+        self.assertEqual(
+            4, self.value(metrics, 'sessionize_sessions_opened_total')
+        )
+        self.assertEqual(
+            2, self.value(metrics, 'sessionize_sessions_closed_total')
+        )
+        self.assertEqual(
+            2, self.value(metrics, 'sessionize_sessions_forced_total')
+        )
+        # Only the sweep expiring Alan's and Brad's sessions is timed
+        self.assertEqual(
+            1, metrics.histogram('sessionize_sweep_seconds').count
+        )
+
+    def test_sessionize_open_sessions(self):
+        metrics = Metrics()
+        sessions = OrderedDict()
+        list(utils.sessionize(self.log, 0, 1, timedelta(5), sessions,
+                              metrics=metrics))
+        self.assertEqual(
+            2, metrics.gauge('sessionize_open_sessions').value
+        )
+        self.assertEqual(
+            0, self.value(metrics, 'sessionize_sessions_forced_total')
+        )
+
+        # Resuming counts only the rows and sessions of the new call
+        metrics = Metrics()
+        later = self.now + timedelta(10)
+        rows = [(later, 'cate', 'success'), (later, 'dave', 'fail')]
+        list(utils.sessionize(rows, 0, 1, timedelta(5), sessions,
+                              metrics=metrics))
+        self.assertEqual(2, self.value(metrics, 'sessionize_rows_total'))
+        self.assertEqual(
+            1, self.value(metrics, 'sessionize_sessions_opened_total')
+        )
+        self.assertEqual(
+            3, metrics.gauge('sessionize_open_sessions').value
+        )
+
+    def test_log_regex(self):
+        metrics = Metrics()
+        pattern = r'[[ {{2:fail}} ]]+[[ {{2:success}} ]]'
+        p = logre.LogRegex(pattern, metrics=metrics)
+        sessions = [
+            session for _, session in
+            utils.sessionize(self.log, 0, 1, timedelta(10))
+        ]
+        self.assertEqual(
+            list(logre.LogRegex(pattern).finditer_m(sessions)),
+            list(p.finditer_m(sessions))
+        )
+        self.assertEqual(
+            3, self.value(metrics, 'logregex_sessions_total', pattern=pattern)
+        )
+        self.assertEqual(
+            2, self.value(metrics, 'logregex_matches_total', pattern=pattern)
+        )
+        self.assertEqual(
+            3, metrics.histogram('logregex_match_seconds',
+                                 pattern=pattern).count
+        )
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import pickle
+import random
+import unittest
+from collections import Counter
+
+from loganalysis.paths import SpaceSaving, TopPaths
+
+
+class SpaceSavingTest(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(0)
+        # Zipf-like stream: a few heavy hitters and a long tail
+        self.stream = [
+            'item/%d' % int(rnd.paretovariate(1.2)) for _ in range(5000)
+        ]
+        self.exact = Counter(self.stream)
+
+    def test_error_bounds(self):
+        counter = SpaceSaving(20)
+        for item in self.stream:
+            counter.update(item)
+
+        self.assertEqual(20, len(counter))
+        self.assertEqual(len(self.stream), counter.total)
+        for item, count, error in counter.top():
+            self.assertLessEqual(count - error, self.exact[item])
+            self.assertGreaterEqual(count, self.exact[item])
+
+        # Heavy hitters should always be tracked
+        for item, count in self.exact.items():
+            if count > counter.total / counter.capacity:
+                self.assertIn(item, counter)
+
+    def test_exact_under_capacity(self):
+        counter = SpaceSaving(1000)
+        for item in self.stream:
+            counter.update(item)
+        self.assertListEqual(
+            [(item, count, 0) for item, count in self.exact.most_common(5)],
+            counter.top(5),
+        )
+
+    def test_merge(self):
+        left = SpaceSaving(20)
+        right = SpaceSaving(20)
+        half = len(self.stream) // 2
+        for item in self.stream[:half]:
+            left.update(item)
+        for item in self.stream[half:]:
+            right.update(item)
+
+        merged = left.merge(right)
+        self.assertEqual(len(self.stream), merged.total)
+        self.assertLessEqual(len(merged), 20)
+        for item, count, error in merged.top():
+            self.assertLessEqual(count - error, self.exact[item])
+            self.assertGreaterEqual(count, self.exact[item])
+        self.assertEqual(
+            self.exact.most_common(1)[0][0], merged.top(1)[0][0]
+        )
+
+        # Merged summary should keep working as a regular summary
+        merged.update('item/1')
+        self.assertEqual(len(self.stream) + 1, merged.total)
+
+    def test_invalid_capacity(self):
+        self.assertRaises(ValueError, SpaceSaving, 0)
+
+
+class TopPathsTest(unittest.TestCase):
+    def setUp(self):
+        self.sessions = [
+            [('alan', 'login'), ('alan', 'shop'), ('alan', 'buy')],
+            [('brad', 'login'), ('brad', 'shop'), ('brad', 'logout')],
+            [('cate', 'login'), ('cate', 'shop'), ('cate', 'buy')],
+            [('dave', 'shop')],
+        ]
+
+    def test_top(self):
+        paths = TopPaths(3, 1)
+        paths.update_m(self.sessions)
+        self.assertEqual(3, paths.total)
+        self.assertListEqual(
+            [(('login', 'shop', 'buy'), 2, 0)], paths.top(1)
+        )
+
+    def test_merge_partial_results(self):
+        left = TopPaths(2, 1)
+        left.update_m(self.sessions[:2])
+        right = pickle.loads(pickle.dumps(TopPaths(2, 1)))
+        right.update_m(self.sessions[2:])
+
+        merged = left.merge(right)
+        self.assertEqual(6, merged.total)
+        self.assertListEqual([(('login', 'shop'), 3, 0)], merged.top(1))
+
+    def test_merge_incompatible(self):
+        self.assertRaises(ValueError, TopPaths(2, 1).merge, TopPaths(3, 1))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from loganalysis import logre, profiling, utils
+
+
+class SessionProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.sessions = [
+            ('user/%d' % i, [
+                (str(t), 'user/%d' % i, 'fail' if t % 3 else 'success')
+                for t in range(i * 10)
+            ])
+            for i in range(1, 6)
+        ]
+        self.pattern = r'[[ {{2:fail}} ]]{2}[[ {{2:success}} ]]'
+
+    def test_finditer_m(self):
+        profiler = profiling.SessionProfiler(n=2)
+        regex = logre.LogRegex(self.pattern)
+        actual = list(profiler.finditer_m(regex, iter(self.sessions)))
+        expected = [
+            (cid, match)
+            for cid, session in self.sessions
+            for match in regex.finditer(session)
+        ]
+        self.assertListEqual(expected, actual)
+
+        slowest = profiler.slowest(self.pattern)
+        self.assertEqual(2, len(slowest))
+        self.assertGreaterEqual(slowest[0].seconds, slowest[1].seconds)
+        self.assertEqual(self.pattern, slowest[0].key)
+        self.assertEqual(len(slowest[0].session), slowest[0].length)
+
+    def test_record(self):
+        profiler = profiling.SessionProfiler(n=2)
+        for seconds, (cid, session) in zip([3, 1, 5, 2, 4], self.sessions):
+            profiler.record('p', seconds, cid, session)
+        self.assertListEqual(
+            [(5, 'user/3'), (4, 'user/5')],
+            [(slow.seconds, slow.cid) for slow in profiler.slowest('p')]
+        )
+
+    def test_fsm(self):
+        table = {
+            ('init', 'fail'): (None, 'failed'),
+            ('failed', 'success'): ('recovered', 'init'),
+        }
+        profiler = profiling.SessionProfiler()
+        cid, session = self.sessions[0]
+        self.assertListEqual(
+            list(utils.fsm((row[2] for row in session), 'init', table)),
+            profiler.fsm(session, 2, 'init', table, cid, key='recovery')
+        )
+        self.assertListEqual(['recovery'], profiler.keys())
+
+    def test_fsm_key(self):
+        table = {('init', 'fail'): ('failed', 'init')}
+        other = {('init', 'success'): ('recovered', 'init')}
+        profiler = profiling.SessionProfiler()
+        for cid, session in self.sessions:
+            profiler.fsm(session, 2, 'init', table, cid)
+            profiler.fsm(session, 2, 'init', other, cid)
+        self.assertListEqual(
+            sorted([profiling.fsm_key(2, 'init', table),
+                    profiling.fsm_key(2, 'init', other)]),
+            profiler.keys()
+        )
+        self.assertEqual(
+            profiling.fsm_key(2, 'init', table),
+            profiling.fsm_key(2, 'init', dict(table))
+        )
+
+    def test_invalid_n(self):
+        self.assertRaises(ValueError, profiling.SessionProfiler, n=0)
+
+    def test_dump_and_load(self):
+        table = {('init', 'fail'): ('failed', 'init')}
+        profiler = profiling.SessionProfiler(n=3)
+        regex = logre.LogRegex(self.pattern)
+        list(profiler.finditer_m(regex, iter(self.sessions)))
+        for cid, session in self.sessions:
+            profiler.fsm(session, 2, 'init', table, cid)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'slow.pickle')
+            profiler.dump(path)
+            loaded = profiling.load(path)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        # LogRegex targets are loaded as equivalent objects
+        self.assertListEqual([slow[:-1] for slow in profiler.slowest()],
+                             [slow[:-1] for slow in loaded])
+
+        # Dumped sessions of both patterns and state machines can be
+        # replayed
+        self.assertEqual(6, len(loaded))
+        for slow in loaded:
+            if isinstance(slow.target, logre.LogRegex):
+                expected = list(regex.finditer(slow.session))
+            else:
+                expected = list(utils.fsm(
+                    (row[2] for row in slow.session), 'init', table
+                ))
+            self.assertListEqual(expected, profiling.replay(slow))
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division
+
+import socket
+import threading
+import time
+import unittest
+
+from loganalysis import utils
+from loganalysis.receiver import Receiver, send
+
+
+class ReceiverTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver = Receiver(udp_port=0, tcp_port=0, batch_size=4,
+                                 batch_timeout=0.05)
+        self.receiver.start()
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def wait_for(self, n_rows, timeout=5):
+        deadline = time.time() + timeout
+        while self.receiver.received + self.receiver.dropped < n_rows:
+            if time.time() > deadline:
+                break
+            time.sleep(0.01)
+        self.receiver.stop()
+        return list(self.receiver.rows())
+
+    def test_tcp(self):
+        lines = [u'%d\tuser/%d\tevent' % (i, i % 3) for i in range(10)]
+        _, port = self.receiver.tcp_address
+        self.assertEqual(10, send(lines, port, protocol='tcp',
+                                  lines_per_packet=3))
+
+        rows = self.wait_for(10)
+        self.assertListEqual([tuple(line.split(u'\t')) for line in lines],
+                             rows)
+
+    def test_udp(self):
+        lines = [u'%d\tuser/%d\tevent' % (i, i % 3) for i in range(10)]
+        _, port = self.receiver.udp_address
+        send(lines, port, protocol='udp', lines_per_packet=2)
+
+        rows = self.wait_for(10)
+        self.assertEqual(10, len(rows))
+        self.assertEqual(0, self.receiver.dropped)
+
+    def test_sessionize(self):
+        lines = [
+            u'0\talan\tlogin', u'1\tbrad\tlogin', u'2\talan\tlogout',
+        ]
+        _, port = self.receiver.tcp_address
+        send(lines, port, protocol='tcp')
+
+        rows = ((int(ts), cid, e) for ts, cid, e in self.wait_for(3))
+        sessions = list(utils.sessionize(rows, 0, 1, 5))
+        self.assertListEqual(
+            [
+                (u'alan', [(0, u'alan', u'login'), (2, u'alan', u'logout')]),
+                (u'brad', [(1, u'brad', u'login')]),
+            ],
+            sessions
+        )
+
+
+class ShutdownTest(unittest.TestCase):
+    def test_concurrent_consumer(self):
+        receiver = Receiver(tcp_port=0, maxsize=2, batch_size=1,
+                            batch_timeout=0.01)
+        receiver.start()
+        rows = []
+        consumer = threading.Thread(
+            target=lambda: rows.extend(receiver.rows())
+        )
+        consumer.start()
+
+        _, port = receiver.tcp_address
+        send((u'%d\talan\tevent' % i for i in range(200)), port,
+             protocol='tcp', lines_per_packet=50)
+        receiver.stop()
+        consumer.join(5)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(receiver.received, len(rows))
+
+    def test_unterminated_line_is_discarded_on_stop(self):
+        receiver = Receiver(tcp_port=0, batch_timeout=0.01)
+        receiver.start()
+        conn = socket.create_connection(receiver.tcp_address)
+        try:
+            conn.sendall(b'0\talan\tlogin\n1\talan\tlog')
+            deadline = time.time() + 5
+            while receiver.received < 1 and time.time() < deadline:
+                time.sleep(0.01)
+            receiver.stop()
+        finally:
+            conn.close()
+
+        self.assertListEqual([(u'0', u'alan', u'login')],
+                             list(receiver.rows()))
+
+    def test_rows_after_full_queue(self):
+        receiver = Receiver(udp_port=0, maxsize=1, batch_size=1,
+                            batch_timeout=0.01)
+        receiver.start()
+        _, port = receiver.udp_address
+        send([u'a', u'b'], port)
+        deadline = time.time() + 5
+        while receiver.received < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        receiver.stop()
+
+        # The end of the stream doesn't fit in the queue, but rows() still
+        # returns after draining it
+        self.assertListEqual([(u'a',)], list(receiver.rows()))
+        self.assertListEqual([], list(receiver.rows()))
+
+
+class BackpressureTest(unittest.TestCase):
+    def test_udp_drop(self):
+        receiver = Receiver(udp_port=0, maxsize=1, batch_size=1,
+                            batch_timeout=0.05)
+        receiver.start()
+        _, port = receiver.udp_address
+        send((u'line %d' % i for i in range(50)), port)
+
+        deadline = time.time() + 5
+        while receiver.received + receiver.dropped < 50:
+            if time.time() > deadline:
+                break
+            time.sleep(0.01)
+        receiver.stop()
+
+        # Nobody consumed rows, so only one batch fits in the queue
+        self.assertEqual(1, receiver.received)
+        self.assertEqual(49, receiver.dropped)
+        self.assertEqual(1, len(list(receiver.rows())))
+
+    def test_invalid_protocol(self):
+        self.assertRaises(ValueError, send, [], 0, protocol='http')
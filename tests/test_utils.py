@@ -4,11 +4,113 @@
 from __future__ import division
 
 import unittest
+from collections import Counter, OrderedDict
 from datetime import datetime, timedelta
 
 from loganalysis import utils
 
 
+class SamplingTest(unittest.TestCase):
+    def setUp(self):
+        self.log = [('user/%d' % (i % 500), i) for i in range(5000)]
+
+    def sampled_clients(self, rate, salt=''):
+        return set(cid for cid, _ in utils.sample(self.log, 0, rate, salt))
+
+    def test_keep_entire_clients(self):
+        sampled = list(utils.sample(self.log, 0, 0.2))
+        clients = set(cid for cid, _ in sampled)
+        self.assertEqual(10 * len(clients), len(sampled))
+        self.assertTrue(70 < len(clients) < 130)
+
+    def test_reproducible(self):
+        self.assertSetEqual(
+            self.sampled_clients(0.2), self.sampled_clients(0.2)
+        )
+
+    def test_nested(self):
+        self.assertTrue(
+            self.sampled_clients(0.05) <= self.sampled_clients(0.2)
+        )
+
+    def test_salt(self):
+        self.assertNotEqual(
+            self.sampled_clients(0.2), self.sampled_clients(0.2, 'other')
+        )
+
+    def test_encodings(self):
+        # Text and UTF-8 bytes of the same id are sampled alike, and so are
+        # ids that aren't strings
+        for rate in [0.1, 0.5, 0.9]:
+            self.assertEqual(
+                len(list(utils.sample([(u'\xe9lan', 'x')], 0, rate))),
+                len(list(utils.sample([(b'\xc3\xa9lan', 'x')], 0, rate)))
+            )
+        self.assertEqual(
+            utils._client_hash(u'42', u's'), utils._client_hash(42, b's')
+        )
+
+    def test_bounds(self):
+        self.assertListEqual([], list(utils.sample(self.log, 0, 0)))
+        self.assertListEqual(self.log, list(utils.sample(self.log, 0, 1)))
+        self.assertRaises(ValueError, list, utils.sample(self.log, 0, 1.5))
+
+
+class DeduplicatorTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2015, 1, 1, 0, 0, 0)
+        self.horizon = timedelta(minutes=1)
+
+    def test_exact_duplicates(self):
+        log = [
+            (self.now + timedelta(seconds=0), 'alan', 'fail'),
+            (self.now + timedelta(seconds=0), 'alan', 'fail'),
+            (self.now + timedelta(seconds=1), 'alan', 'fail'),
+            (self.now + timedelta(seconds=0), 'alan', 'fail'),
+            (self.now + timedelta(seconds=2), 'alan', 'success'),
+        ]
+        dedup = utils.Deduplicator(0, self.horizon)
+        self.assertListEqual(
+            [log[0], log[2], log[4]], list(dedup.filter(iter(log)))
+        )
+        self.assertEqual(2, dedup.suppressed)
+
+    def test_key_indices(self):
+        log = [
+            ('event/1', self.now + timedelta(seconds=0), 'alan', 'fail'),
+            ('event/1', self.now + timedelta(seconds=3), 'alan', 'fail'),
+            ('event/2', self.now + timedelta(seconds=3), 'alan', 'fail'),
+        ]
+        dedup = utils.Deduplicator(1, self.horizon, key_indices=[0])
+        self.assertListEqual(
+            [log[0], log[2]], list(dedup.filter(iter(log)))
+        )
+
+    def test_horizon(self):
+        log = [(0, 'x'), (9, 'x'), (9, 'y'), (15, 'y'), (25, 'x'), (26, 'x')]
+        dedup = utils.Deduplicator(0, 10, key_indices=[1])
+        # 'x' at 9 and 'y' at 15 are within the horizon, and 'x' at 25
+        # arrives after every bucket holding 'x' has been discarded.
+        self.assertListEqual(
+            [(0, 'x'), (9, 'y'), (25, 'x')], list(dedup.filter(iter(log)))
+        )
+        self.assertEqual(3, dedup.suppressed)
+
+    def test_bounded_memory(self):
+        dedup = utils.Deduplicator(0, 10)
+        log = ((t, 'user/%d' % t) for t in range(10000))
+        self.assertEqual(10000, len(list(dedup.filter(log))))
+        self.assertLessEqual(
+            len(dedup._current) + len(dedup._previous), 20
+        )
+
+    def test_state_across_calls(self):
+        dedup = utils.Deduplicator(0, 10)
+        self.assertEqual(1, len(list(dedup.filter([(0, 'x')]))))
+        self.assertEqual(0, len(list(dedup.filter([(0, 'x')]))))
+        self.assertEqual(1, dedup.suppressed)
+
+
 class SessionizingTest(unittest.TestCase):
     def setUp(self):
         self.now = datetime.now()
@@ -123,6 +225,119 @@ class SessionizingTest(unittest.TestCase):
         self.assertListEqual(expected, actual)
 
 
+class WindowTest(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2015, 1, 1, 0, 0, 0)
+        self.size = timedelta(minutes=1)
+
+    def test_empty(self):
+        self.assertListEqual(
+            [], list(utils.window(iter([]), 0, self.size))
+        )
+
+    def test_tumbling(self):
+        log = iter([
+            (self.now + timedelta(seconds=0), 'alan', 'login'),
+            (self.now + timedelta(seconds=30), 'brad', 'login'),
+            (self.now + timedelta(seconds=50), 'alan', 'logout'),
+            # No row in the 2nd minute
+            (self.now + timedelta(seconds=150), 'alan', 'login'),
+        ])
+        actual = list(utils.window(log, 0, self.size, key_index=2,
+                                   cid_index=1))
+        expected = [
+            utils.Window(
+                self.now, self.now + self.size, 3,
+                Counter({'login': 2, 'logout': 1}), 2
+            ),
+            utils.Window(
+                self.now + 2 * self.size, self.now + 3 * self.size, 1,
+                Counter({'login': 1}), 1
+            ),
+        ]
+        self.assertListEqual(expected, actual)
+
+    def test_emit_as_soon_as_closed(self):
+        def log():
+            yield (self.now + timedelta(seconds=0), 'alan')
+            yield (self.now + timedelta(seconds=60), 'alan')
+            raise AssertionError('Should not read further')
+
+        windows = utils.window(log(), 0, self.size)
+        self.assertEqual(self.now, next(windows).start)
+
+    def test_sliding(self):
+        log = iter([(0, 'alan'), (1, 'brad'), (3, 'alan'), (10, 'cate')])
+        actual = [
+            (w.start, w.end, w.rows, w.clients)
+            for w in utils.window(log, 0, 4, slide=2, cid_index=1)
+        ]
+        expected = [
+            (-2, 2, 2, 2),
+            (0, 4, 3, 2),
+            (2, 6, 1, 1),
+            (8, 12, 1, 1),
+            (10, 14, 1, 1),
+        ]
+        self.assertListEqual(expected, actual)
+
+    def test_late_rows_are_ignored(self):
+        log = iter([(0, 'alan'), (5, 'brad'), (1, 'cate'), (6, 'dave')])
+        actual = [(w.start, w.rows) for w in utils.window(log, 0, 5)]
+        self.assertListEqual([(0, 1), (5, 2)], actual)
+
+    def test_invalid_size(self):
+        log = [(self.now, 'alan')]
+        for size, slide in [
+            (timedelta(0), None),
+            (self.size, timedelta(0)),
+            (self.size, -self.size),
+            (-1, 1),
+        ]:
+            self.assertRaises(ValueError, list,
+                              utils.window(log, 0, size, slide=slide))
+
+    def test_epoch_timestamps(self):
+        log = iter([(1420070400.5, 'alan'), (1420070459.9, 'brad'),
+                    (1420070460.0, 'alan')])
+        actual = [(w.start, w.rows) for w in utils.window(log, 0, 60.0)]
+        self.assertListEqual([(1420070400.0, 2), (1420070460.0, 1)], actual)
+
+    def test_sub_second_slide(self):
+        log = iter([(self.now + timedelta(microseconds=1500000), 'alan')])
+        actual = [
+            w.start for w in utils.window(
+                log, 0, timedelta(seconds=1),
+                slide=timedelta(microseconds=500000)
+            )
+        ]
+        self.assertListEqual(
+            [self.now + timedelta(seconds=1),
+             self.now + timedelta(microseconds=1500000)],
+            actual
+        )
+
+
+class ResumableSessionizingTest(unittest.TestCase):
+    def test_resume(self):
+        sessions = OrderedDict()
+        first = iter([(0, 'alan', 'login'), (1, 'brad', 'login')])
+        self.assertListEqual(
+            [], list(utils.sessionize(first, 0, 1, 5, sessions))
+        )
+        self.assertEqual(['alan', 'brad'], list(sessions))
+
+        second = iter([(2, 'alan', 'logout'), (8, 'cate', 'login')])
+        self.assertListEqual(
+            [
+                ('alan', [(0, 'alan', 'login'), (2, 'alan', 'logout')]),
+                ('brad', [(1, 'brad', 'login')]),
+            ],
+            list(utils.sessionize(second, 0, 1, 5, sessions))
+        )
+        self.assertEqual(['cate'], list(sessions))
+
+
 class StateMachineTest(unittest.TestCase):
     def test_simple_login_and_out(self):
         table = {